@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import main
+
+# Benchmark harness for the report pipeline. Synthetic CoDate and ItemList books are generated with
+# the same columns the analysis reads, and every stage is timed and memory-profiled on its own.
+# Results are written as JSON so two versions can be compared with --compare.
+
+DEFAULT_SIZES = [10000, 100000, 1000000, 10000000]
+# Writing a workbook this large just to parse it again takes longer than the rest of the run
+DEFAULT_XLSX_ROWS_LIMIT = 100000
+
+def generate_codate(rows, seed=0, whole_minutes=False):
+    rng = np.random.default_rng(seed)
+    cells = np.array(list(main.cell_run_rates))
+    items = np.array([f"{rng.integers(100000, 999999)}-{i:05d}" for i in range(max(rows // 20, 10))])
+    customers = np.array([f"C{i:05d}" for i in range(max(rows // 200, 5))], dtype=object)
+    promship = pd.Timestamp.today().normalize() + pd.to_timedelta(rng.integers(-14, 120, rows), unit="D")
+
+    cust_ids = customers[rng.integers(0, len(customers), rows)]
+    # Whole-minute books have longer jobs, so their products overflow a small integer type
+    minutes = np.round(rng.gamma(2.0, 60.0, rows)) if whole_minutes else np.round(rng.gamma(2.0, 1.5, rows), 3)
+    cust_ids[rng.random(rows) < 0.02] = None
+    return pd.DataFrame({
+        "Item Number": items[rng.integers(0, len(items), rows)],
+        "CustID": cust_ids,
+        "Buyer": cells[rng.integers(0, len(cells), rows)],
+        "WCRMins": minutes,
+        "OrderQty": rng.integers(1, 500, rows).astype("float64"),
+        "PromShip": promship.strftime("%d-%b-%y"),
+    })
+
+def generate_itemlist(rows, seed=0):
+    rng = np.random.default_rng(seed + 1)
+    cells = np.array(list(main.cell_run_rates))
+    parents = np.array([f"{rng.integers(100000, 999999)}-{i:05d}" for i in range(max(rows // 10, 10))])
+    quantity = rng.integers(1, 6000, rows).astype("float64")
+    quantity[rng.random(rows) < 0.05] = np.nan
+    return pd.DataFrame({
+        "Buyer": cells[rng.integers(0, len(cells), rows)],
+        "Parent": parents[rng.integers(0, len(parents), rows)],
+        "Quantity": quantity,
+    })
+
+def generate_scenarios(count, seed=0):
+    # Each what-if scenario scales the run rates of a few random cells
+    rng = np.random.default_rng(seed + 2)
+    cells = list(main.cell_run_rates)
+    return {
+        f"Scenario {i + 1}": {cell: main.cell_run_rates[cell] * rng.uniform(0.5, 1.5) for cell in rng.choice(cells, 5, replace=False)}
+        for i in range(count)
+    }
+
+def run_stage(fn, trace_memory=False):
+    # RSS is sampled on a background thread, which gives a per-stage peak for numpy and pandas work at
+    # almost no cost (tracemalloc is exact but slows pure Python stages down several times)
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with main.rss_monitor.track() as usage:
+            start_time = time.perf_counter()
+            value = fn()
+            seconds = time.perf_counter() - start_time
+        peak_alloc = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    stats = {
+        "seconds": round(seconds, 4),
+        "rss_growth_mb": main.rss_usage_mb(usage)[1],
+        "peak_alloc_mb": None if peak_alloc is None else round(peak_alloc / (1024 * 1024), 1),
+        "peak_rss_mb": main.peak_rss_mb(),
+    }
+    return value, stats
+
+def frame_mb(df):
+    return round(df.memory_usage(deep=True).sum() / (1024 * 1024), 1)
+
+def ingest_reports(codate, itemlist, work_dir, xlsx_rows_limit, trace_memory):
+    stages = {}
+    if len(codate) > xlsx_rows_limit:
+        return {"ingestion": {"skipped": f"more than {xlsx_rows_limit} rows"}}
+
+    for name, df in (("codate", codate), ("itemlist", itemlist)):
+        path = os.path.join(work_dir, f"{name}.xlsx")
+        df.to_excel(path, index=False)
+        _, stages[f"ingestion_{name}_xlsx"] = run_stage(lambda: main.read_report_file(name, path), trace_memory)
+        # The second read finds the Parquet sidecar the first one wrote, which needs pyarrow
+        if main.PYARROW_AVAILABLE:
+            _, stages[f"ingestion_{name}_sidecar"] = run_stage(lambda: main.read_report_file(name, path), trace_memory)
+        else:
+            stages[f"ingestion_{name}_sidecar"] = {"skipped": "pyarrow is not installed"}
+    return stages
+
+def check_same_result(expected, actual):
+    for table in ("critical", "per_buyer", "per_buyer_codate"):
+        if len(getattr(expected, table)) != len(getattr(actual, table)):
+            raise ValueError(f"Compacted analysis gives {len(getattr(actual, table))} rows of {table}, expected {len(getattr(expected, table))}")
+    if not np.allclose(expected.critical["MinutesOfJob"].to_numpy(dtype="float64"),
+                       actual.critical["MinutesOfJob"].to_numpy(dtype="float64")):
+        raise ValueError("Compacted analysis gives different minutes for the critical entries")
+
+def benchmark_size(rows, work_dir, xlsx_rows_limit, trace_memory, seed=0):
+    codate = generate_codate(rows, seed)
+    itemlist = generate_itemlist(rows, seed)
+    cell_run = main.df_cell_run
+    rates = main.cell_run_rates
+
+    stages = ingest_reports(codate, itemlist, work_dir, xlsx_rows_limit, trace_memory)
+    codate["PromShip"] = main.parse_promship(codate["PromShip"])
+
+    (codate_clean, itemlist_clean), stages["cleaning"] = run_stage(
+        lambda: (main.clean_codate(codate), main.clean_itemlist(itemlist)), trace_memory)
+
+    _, stages["groupbys"] = run_stage(lambda: [
+        main.grouped_totals(itemlist_clean, "Buyer", "Quantity"),
+        main.grouped_totals(itemlist_clean, "Parent", "Quantity"),
+        main.grouped_totals(codate_clean, "Buyer", "WCRMins"),
+        main.grouped_totals(codate_clean, "Item Number", "WCRMins"),
+    ], trace_memory)
+
+    lines, stages["merge"] = run_stage(
+        lambda: main.add_cell_load(main.cell_lines(codate_clean).sort_values(by="PromShip", kind="stable"), cell_run, rates),
+        trace_memory)
+
+    _, stages["critical_filter"] = run_stage(lambda: lines[lines["ExceedsHalfaDaysWork"].to_numpy()], trace_memory)
+
+    result, stages["analysis_total"] = run_stage(
+        lambda: main.analyse_orders(codate, itemlist, cell_run, rates), trace_memory)
+
+    # The same analysis on the categorical, downcast frames the pipeline hands to it
+    (codate_compact, itemlist_compact), stages["compact"] = run_stage(
+        lambda: main.compact_reports(codate, itemlist), trace_memory)
+    stages["compact"]["raw_mb"] = frame_mb(codate) + frame_mb(itemlist)
+    stages["compact"]["compact_mb"] = frame_mb(codate_compact) + frame_mb(itemlist_compact)
+    # Bound as defaults, so the lambdas never refer to names deleted below
+    _, stages["analysis_total_compact"] = run_stage(
+        lambda frames=(codate_compact, itemlist_compact): main.analyse_orders(*frames, cell_run, rates), trace_memory)
+    del codate_compact, itemlist_compact
+
+    # Whole-number WCRMins make every numeric column look downcastable, which must not change the results
+    codate_whole = generate_codate(rows, seed, whole_minutes=True)
+    codate_whole["PromShip"] = main.parse_promship(codate_whole["PromShip"])
+    expected = main.analyse_orders(codate_whole, itemlist, cell_run, rates)
+    compact_result, stages["analysis_compact_whole_mins"] = run_stage(
+        lambda codate_whole=codate_whole: main.analyse_orders(*main.compact_reports(codate_whole, itemlist), cell_run, rates),
+        trace_memory)
+    check_same_result(expected, compact_result)
+    del codate_whole, expected, compact_result
+
+    _, stages["capacity_forecast"] = run_stage(lambda: main.capacity_forecast(result.codate), trace_memory)
+
+    for count in (1, 100):
+        scenarios = generate_scenarios(count, seed)
+        _, stages[f"scenarios_{count}"] = run_stage(
+            lambda: main.compare_scenarios(result.codate, main.scenario_rate_matrix(scenarios, rates)), trace_memory)
+
+    sheet_set = "full" if len(result.itemlist) < main.EXCEL_MAX_ROWS else "summary"
+    output_dir = os.path.join(work_dir, "output")
+    _, stages["excel_write"] = run_stage(
+        lambda: main.write_outputs(main.result_sheets(result), output_dir, sheet_set, ("xlsx",)), trace_memory)
+    stages["excel_write"]["sheet_set"] = sheet_set
+
+    return {"rows": rows, "codate_lines": len(result.codate), "critical": len(result.critical), "stages": stages}
+
+# Modules that should only be loaded by the stage that needs them, never by importing main
+HEAVY_MODULES = ("pandas", "numpy", "selenium", "requests", "xlsxwriter", "office365", "tkinter")
+
+def benchmark_import(repeats=5):
+    # Cold import of main in a fresh interpreter each time, the cost a user pays before the GUI appears
+    code = ("import sys, time; start = time.perf_counter(); import main; seconds = time.perf_counter() - start; "
+            f"print(seconds); print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+        timings.append(float(output[0]))
+    return {"seconds": round(min(timings), 4), "heavy_modules": [m for m in output[1].split(",") if m]}
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+def compare_results(previous, current):
+    old_import, new_import = previous.get("import", {}), current.get("import", {})
+    if "seconds" in old_import and "seconds" in new_import:
+        print(f"\nimport main  {old_import['seconds']:.3f}s -> {new_import['seconds']:.3f}s")
+    previous_sizes = {entry["rows"]: entry["stages"] for entry in previous["results"]}
+    for entry in current["results"]:
+        old_stages = previous_sizes.get(entry["rows"])
+        if not old_stages:
+            continue
+        print(f"\n{entry['rows']} rows (vs {previous.get('revision') or 'previous run'})")
+        for stage, stats in entry["stages"].items():
+            old = old_stages.get(stage, {})
+            if "seconds" not in stats or "seconds" not in old:
+                continue
+            ratio = stats["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+            flag = "  <-- slower" if ratio > 1.2 else ""
+            print(f"  {stage:<28} {old['seconds']:>9.3f}s -> {stats['seconds']:>9.3f}s  x{ratio:.2f}{flag}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Run Rates pipeline on synthetic reports")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="comma separated row counts (default 10k,100k,1M,10M)")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    parser.add_argument("--xlsx-rows-limit", type=int, default=DEFAULT_XLSX_ROWS_LIMIT,
+                        help="largest size for which the xlsx ingestion stage is run")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="also trace Python allocations per stage; exact, but slows the pure Python stages down")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--import-only", action="store_true", help="only measure the cold import time of main")
+    return parser.parse_args(argv)
+
+def main_benchmark(argv=None):
+    args = parse_args(argv)
+    sizes = [] if args.import_only else [int(size) for size in args.sizes.split(",")]
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "tracemalloc": args.tracemalloc,
+        "import": benchmark_import(),
+        "results": [],
+    }
+    heavy = ", ".join(results["import"]["heavy_modules"]) or "none"
+    print(f"  {'import main':<28} {results['import']['seconds']:>9.3f}s  heavy modules loaded: {heavy}")
+
+    for rows in sizes:
+        work_dir = tempfile.mkdtemp(prefix="runrates-bench-")
+        try:
+            print(f"Benchmarking {rows} rows...")
+            entry = benchmark_size(rows, work_dir, args.xlsx_rows_limit, args.tracemalloc, args.seed)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        results["results"].append(entry)
+        for stage, stats in entry["stages"].items():
+            if "seconds" in stats:
+                memory = f"RSS +{stats['rss_growth_mb']} MB" if stats["rss_growth_mb"] is not None else ""
+                if stats["peak_alloc_mb"] is not None:
+                    memory += f"  peak alloc {stats['peak_alloc_mb']} MB"
+                if "compact_mb" in stats:
+                    memory += f"  frames {stats['raw_mb']} MB -> {stats['compact_mb']} MB"
+                print(f"  {stage:<28} {stats['seconds']:>9.3f}s  {memory}")
+            else:
+                print(f"  {stage:<28} skipped ({stats.get('skipped')})")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), results)
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
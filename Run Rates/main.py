@@ -1,47 +1,261 @@
 import os
+import sys
 import time
+import json
+import shutil
+import hashlib
+import argparse
+import cProfile
+import importlib.util
 import logging
-import pandas as pd
-from datetime import datetime
-from plyer import notification
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-import tkinter as tk
-from tkinter import ttk, simpledialog, messagebox
-from io import StringIO
-from office365.runtime.auth.client_credential import ClientCredential
-from office365.sharepoint.client_context import ClientContext
-from office365.sharepoint.files.file import File
-from requests_ntlm import HttpNtlmAuth
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
+import threading
+import queue
+import atexit
+import sqlite3
+from contextlib import contextmanager
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, date
+from io import BytesIO
+from urllib.parse import quote
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Optional accelerators for report ingestion, used when installed
+PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+CALAMINE_AVAILABLE = importlib.util.find_spec("python_calamine") is not None
+
+class LazyModule:
+    # Stands in for a module until one of its attributes is first used, so the window can open
+    # before pandas and numpy have loaded. Selenium, requests and xlsxwriter are imported inside
+    # the functions that use them, so headless and cached runs never load the browser stack.
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
 
 logger = logging.getLogger(__name__)
 
-# Define the download directory
+def configure_logging():
+    # Called by the entry points rather than on import, so importing main (e.g. from benchmark.py)
+    # neither opens app.log nor changes the caller's logging
+    logging.basicConfig(
+        level=os.environ.get("RUNRATES_LOG_LEVEL", "INFO").upper(),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("app.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+# Finished downloads are moved into the report cache. Each report's own download folder is created,
+# or cleared, just before it is fetched.
 downloads_dir = os.path.join(os.getcwd(), "downloads")
-if not os.path.exists(downloads_dir):
-    os.makedirs(downloads_dir)
-else:
-    for file in os.listdir(downloads_dir):
-        file_path = os.path.join(downloads_dir, file)
+
+cache_dir = os.path.join(os.getcwd(), "report_cache")
+analysis_state_dir = os.path.join(os.getcwd(), "analysis_state")
+metrics_path = os.path.join(os.getcwd(), "metrics.jsonl")
+run_rates_path = os.path.join(os.getcwd(), "run_rates.db")
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Windows has no resource module; psutil reports the peak working set there
+        if psutil is None:
+            return None
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss) / (1024 * 1024)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def current_rss_mb():
+    return psutil.Process().memory_info().rss / (1024 * 1024) if psutil is not None else None
+
+class RssMonitor:
+    # The process high-water mark only ever grows, so it cannot say which step used the memory. One
+    # background thread samples the RSS while anything is tracked and raises the peak of every tracked
+    # block, so nested and concurrent blocks each get their own figure.
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run(self, process):
+        while True:
+            rss = process.memory_info().rss
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                for usage in self._active.values():
+                    usage["peak"] = max(usage["peak"], rss)
+            time.sleep(self.interval)
+
+    @contextmanager
+    def track(self):
+        # Yields a dict whose start and peak RSS (bytes) are filled in; both stay None without psutil
+        usage = {"start": None, "peak": None}
+        if psutil is None:
+            yield usage
+            return
+        process = psutil.Process()
+        token = object()
+        usage["start"] = usage["peak"] = process.memory_info().rss
+        with self._lock:
+            self._active[token] = usage
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(process,), name="rss-monitor", daemon=True)
+                self._thread.start()
         try:
-            if os.path.isfile(file_path):
-                os.unlink(file_path)
+            yield usage
+        finally:
+            rss = process.memory_info().rss
+            with self._lock:
+                del self._active[token]
+                usage["peak"] = max(usage["peak"], rss)
+
+rss_monitor = RssMonitor()
+
+def rss_usage_mb(usage):
+    # Peak RSS during a tracked block and how far it rose above the RSS the block started with
+    if usage["start"] is None:
+        return None, None
+    return round(usage["peak"] / (1024 * 1024), 1), round((usage["peak"] - usage["start"]) / (1024 * 1024), 1)
+
+# Callbacks told about every stage as it starts and finishes, e.g. the GUI's progress panel
+stage_listeners = []
+
+def notify_stage(record, finished):
+    for listener in list(stage_listeners):
+        try:
+            listener(record, finished)
         except Exception as e:
-            logger.error(f"Error deleting file: {e}", exc_info=True)
+            logger.debug(f"Stage listener failed: {e}")
+
+class RunMetrics:
+    # Collects one record per pipeline stage (time, rows, memory) for a single run and writes
+    # them out as one JSON line, so slow runs can be broken down after the fact
+
+    def __init__(self):
+        self.run_id = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.stages = []
+        self._start_time = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, rows=None, **fields):
+        record = {"stage": name, "rows": rows, **fields}
+        notify_stage(record, False)
+        start_time = time.perf_counter()
+        # The stage's own peak and growth come from RSS sampled while it runs; concurrent stages
+        # (the two report fetches) share the process, so each sees the other's memory too
+        try:
+            with rss_monitor.track() as usage:
+                yield record
+            record.setdefault("status", "ok")
+        except BaseException:
+            record["status"] = "error"
+            raise
+        finally:
+            record["seconds"] = round(time.perf_counter() - start_time, 4)
+            record["rss_mb"] = current_rss_mb()
+            record["peak_rss_mb"], record["rss_growth_mb"] = rss_usage_mb(usage)
+            record["thread"] = threading.current_thread().name
+            with self._lock:
+                self.stages.append(record)
+            notify_stage(record, True)
+            logger.debug(f"Stage {name} took {record['seconds']:.3f}s" + (f" ({record['rows']} rows)" if record["rows"] is not None else ""))
+
+    def summary(self, status):
+        return {
+            "run_id": self.run_id,
+            "started": self.started,
+            "status": status,
+            "total_seconds": round(time.perf_counter() - self._start_time, 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": self.stages,
+        }
+
+    def emit(self, status, path=None):
+        record = self.summary(status)
+        try:
+            with open(path or metrics_path, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        except Exception as e:
+            logger.error(f"Error writing run metrics: {e}", exc_info=True)
+        logger.info(f"Run {self.run_id} {status} in {record['total_seconds']:.1f}s")
+        return record
+
+_run_metrics = RunMetrics()
+
+def start_run_metrics():
+    global _run_metrics
+    _run_metrics = RunMetrics()
+    return _run_metrics
+
+def stage(name, rows=None, **fields):
+    return _run_metrics.stage(name, rows, **fields)
+
+class RunCancelled(Exception):
+    pass
+
+# Set by cancel_run; downloads, retries and the analysis check it and give up early
+cancel_event = threading.Event()
+
+def check_cancelled():
+    if cancel_event.is_set():
+        raise RunCancelled("Run cancelled")
+
+@contextmanager
+def profiled(profiler=None, run_id="run"):
+    # Optional whole-run profile: "cprofile" writes a .prof file for snakeviz/pstats,
+    # "pyinstrument" writes an HTML call tree when pyinstrument is installed
+    profiler = profiler or os.environ.get("RUNRATES_PROFILE")
+    if not profiler:
+        yield
+        return
+    if profiler == "pyinstrument":
+        from pyinstrument import Profiler
+        instrument = Profiler()
+        instrument.start()
+        try:
+            yield
+        finally:
+            instrument.stop()
+            path = f"profile-{run_id}.html"
+            with open(path, "w") as f:
+                f.write(instrument.output_html())
+            logger.info(f"Profile written to {path}")
+    else:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            path = f"profile-{run_id}.prof"
+            profile.dump_stats(path)
+            logger.info(f"Profile written to {path}")
 
 #these act as something like a 'default' run rate for each cell, which can be updated by the user
 cell_run_rates = {
@@ -102,14 +316,110 @@ cell_run_rates = {
     "HVY": 1413.00
 }
 
-df_cell_run = pd.DataFrame.from_dict(cell_run_rates, orient='index', columns=['Run Rate'])
+def run_rate_frame(rates=None):
+    # The run rates for one run as a single hash-indexed table of cell -> daily rate; the Item Number
+    # merge and the Buyer map both look up in it, so they can never see different rates
+    rates = cell_run_rates if rates is None else rates
+    return pd.DataFrame({'Run Rate': pd.Series(rates, dtype='float64')})
+
+def __getattr__(name):
+    # df_cell_run is built from the live rates whenever it is asked for, so it is never stale
+    # and importing the module does not need pandas
+    if name == "df_cell_run":
+        return run_rate_frame()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Rates in the store before any edit was saved take effect from this date
+DEFAULT_RATES_EFFECTIVE_DATE = date(2000, 1, 1)
+
+class RunRateStore:
+    # Run-rate history in SQLite, one row per cell and the date that rate took effect. The rates in
+    # force on a date are the latest row per cell on or before it, read in one indexed query.
+
+    def __init__(self, path):
+        self.path = path
+        with self._connection() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS run_rates ("
+                       "cell TEXT NOT NULL, effective_date TEXT NOT NULL, rate REAL NOT NULL, "
+                       "PRIMARY KEY (cell, effective_date))")
+
+    @contextmanager
+    def _connection(self):
+        db = sqlite3.connect(self.path)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def seed(self, rates, effective_date=DEFAULT_RATES_EFFECTIVE_DATE):
+        with self._connection() as db:
+            if db.execute("SELECT 1 FROM run_rates LIMIT 1").fetchone() is not None:
+                return False
+            db.executemany("INSERT INTO run_rates VALUES (?, ?, ?)",
+                           [(cell, effective_date.isoformat(), float(rate)) for cell, rate in rates.items()])
+        logger.info(f"Seeded the run-rate store with {len(rates)} default rates")
+        return True
+
+    def rates_as_of(self, as_of=None):
+        # Cells come back in the order they were first added, which is the order the GUI lists them in
+        as_of = (as_of or date.today()).isoformat()
+        with self._connection() as db:
+            rows = db.execute(
+                "SELECT cell, rate FROM ("
+                " SELECT cell, rate, ROW_NUMBER() OVER (PARTITION BY cell ORDER BY effective_date DESC) AS latest,"
+                " MIN(rowid) OVER (PARTITION BY cell) AS first_added"
+                " FROM run_rates WHERE effective_date <= ?"
+                ") WHERE latest = 1 ORDER BY first_added", (as_of,)).fetchall()
+        return dict(rows)
+
+    def save(self, rates, effective_date=None):
+        # Only cells whose rate differs from the one in force are written, so the history stays small
+        effective_date = effective_date or date.today()
+        current = self.rates_as_of(effective_date)
+        changed = [(cell, effective_date.isoformat(), float(rate)) for cell, rate in rates.items() if current.get(cell) != float(rate)]
+        if changed:
+            with self._connection() as db:
+                db.executemany("INSERT OR REPLACE INTO run_rates VALUES (?, ?, ?)", changed)
+        return len(changed)
+
+    def history(self):
+        with self._connection() as db:
+            return pd.read_sql_query("SELECT cell, effective_date, rate FROM run_rates ORDER BY cell, effective_date", db)
+
+_run_rate_store = None
+
+def get_run_rate_store():
+    # The built-in rates above seed a new store the first time it is opened
+    global _run_rate_store
+    if _run_rate_store is None:
+        _run_rate_store = RunRateStore(run_rates_path)
+        _run_rate_store.seed(cell_run_rates)
+    return _run_rate_store
+
+def report_download_dir(report_name):
+    # Each report downloads into its own folder so concurrent scrapers never see each other's files
+    directory = os.path.join(downloads_dir, report_name)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    else:
+        for file in os.listdir(directory):
+            file_path = os.path.join(directory, file)
+            try:
+                if os.path.isfile(file_path):
+                    os.unlink(file_path)
+            except Exception as e:
+                logger.error(f"Error deleting file: {e}", exc_info=True)
+    return directory
+
+def configure_options(download_dir=downloads_dir):
+    from selenium.webdriver.chrome.options import Options
 
-def configure_options():
     options = Options()
     for arg in ["--headless","--disable-gpu", "--allow-running-insecure-content", "--disable-web-security", "--unsafely-treat-insecure-origin-as-secure=http://hffsuk02"]:
         options.add_argument(arg)
     prefs = {
-        "download.default_directory": downloads_dir,
+        "download.default_directory": download_dir,
         "download.prompt_for_download": False,
         "download.directory_upgrade": True,
         "safebrowsing.enabled": True
@@ -118,265 +428,1286 @@ def configure_options():
     options.add_argument("--disable-features=InsecureDownloadWarnings")
     return options
 
-def get_latest_file_path(directory, extension=".xlsx"):
-    files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(extension)]
-    return max(files, key=os.path.getctime) if files else None
-
-def is_file_downloaded(directory, initial_files, timeout=120):
-    elapsed_time = 0
-    while elapsed_time < timeout:
-        current_files = set(os.listdir(directory))
-        new_files = current_files - initial_files
-        if new_files:
-            new_file = new_files.pop()
-            new_file_path = os.path.join(directory, new_file)
-            if new_file_path.endswith(".xlsx"):
-                return new_file_path
-        time.sleep(1)
-        elapsed_time += 1
+class DriverPool:
+    # A handful of headless Chrome sessions shared by both scrapers and all of their retries,
+    # so the browser start-up cost is paid once per process rather than once per attempt
+
+    def __init__(self, size=2):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._drivers = set()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _launch(self):
+        from selenium import webdriver
+
+        with stage("selenium.launch_browser"):
+            driver = webdriver.Chrome(options=configure_options())
+        with self._lock:
+            self._drivers.add(driver)
+        logger.debug(f"Launched pooled WebDriver ({len(self._drivers)}/{self.size})")
+        return driver
+
+    def _discard(self, driver):
+        with self._lock:
+            self._drivers.discard(driver)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.debug(f"Error quitting WebDriver: {e}")
+
+    def _is_healthy(self, driver):
+        try:
+            driver.window_handles
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, driver):
+        driver.switch_to.default_content()
+        driver.get("about:blank")
+
+    def warm(self):
+        # Start every browser in the background so the first scraper finds one ready
+        def launch_one():
+            with self._slots:
+                with self._lock:
+                    if self._closed or len(self._drivers) >= self.size:
+                        return
+                try:
+                    driver = self._launch()
+                except Exception as e:
+                    logger.warning(f"Could not pre-launch WebDriver: {e}")
+                    return
+                # shutdown() may have run while the browser was starting, after it listed the drivers to quit
+                if self._closed:
+                    self._discard(driver)
+                else:
+                    self._idle.put(driver)
+        for _ in range(self.size):
+            threading.Thread(target=launch_one, name="driver-warmup", daemon=True).start()
+
+    @contextmanager
+    def session(self, download_dir):
+        if self._closed:
+            raise RuntimeError("WebDriver pool has been shut down")
+        with self._slots:
+            driver = None
+            while driver is None:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    driver = self._launch()
+                    break
+                if not self._is_healthy(driver):
+                    logger.info("Discarding unresponsive pooled WebDriver")
+                    self._discard(driver)
+                    driver = None
+
+            try:
+                # Point the reused browser at this report's download folder
+                driver.execute_cdp_cmd("Browser.setDownloadBehavior", {"behavior": "allow", "downloadPath": download_dir})
+                yield driver
+            finally:
+                try:
+                    self._reset(driver)
+                except Exception as e:
+                    logger.info(f"Discarding WebDriver that could not be reset: {e}")
+                    self._discard(driver)
+                else:
+                    if self._closed:
+                        self._discard(driver)
+                    else:
+                        self._idle.put(driver)
+
+    def shutdown(self):
+        self._closed = True
+        with self._lock:
+            drivers = list(self._drivers)
+        for driver in drivers:
+            self._discard(driver)
+        if drivers:
+            logger.debug(f"Shut down {len(drivers)} pooled WebDriver(s)")
+
+_driver_pool = None
+_driver_pool_lock = threading.Lock()
+
+def get_driver_pool():
+    global _driver_pool
+    with _driver_pool_lock:
+        if _driver_pool is None:
+            _driver_pool = DriverPool(size=2)
+            atexit.register(_driver_pool.shutdown)
+    return _driver_pool
+
+def cancel_run():
+    # Quitting the browsers makes a scraper blocked inside a WebDriver call fail straight away;
+    # the next run starts a fresh pool
+    global _driver_pool
+    cancel_event.set()
+    with _driver_pool_lock:
+        pool, _driver_pool = _driver_pool, None
+    if pool is not None:
+        pool.shutdown()
+    logger.info("Run cancelled")
+
+# Chrome writes downloads as <name>.crdownload and renames them once the last byte is on disk
+PARTIAL_DOWNLOAD_SUFFIXES = (".crdownload", ".tmp", ".part")
+
+def new_download_files(directory, initial_files, extension=".xlsx"):
+    current_files = set(os.listdir(directory))
+    if any(f.endswith(PARTIAL_DOWNLOAD_SUFFIXES) for f in current_files):
+        return []
+    return [os.path.join(directory, f) for f in current_files - initial_files if f.endswith(extension)]
+
+def wait_for_directory_change(directory, timeout):
+    # Block until something in the directory is created or renamed, or the timeout passes.
+    # Uses inotify when it is available, otherwise falls back to a short poll.
+    if inotify_simple is None:
+        time.sleep(min(timeout, 0.2))
+        return
+    with inotify_simple.INotify() as inotify:
+        inotify.add_watch(directory, inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO | inotify_simple.flags.CREATE)
+        inotify.read(timeout=int(timeout * 1000))
+
+def wait_for_download(directory, initial_files, timeout=120, extension=".xlsx"):
+    deadline = time.time() + timeout
+    last_size = None
+    with stage("download_wait", directory=os.path.basename(directory)) as record:
+        while time.time() < deadline:
+            if cancel_event.is_set():
+                record["status"] = "cancelled"
+                return None
+            new_files = new_download_files(directory, initial_files, extension)
+            if new_files:
+                new_file = max(new_files, key=os.path.getmtime)
+                size = os.path.getsize(new_file)
+                # A finished file keeps the same non-zero size between two looks
+                if size > 0 and size == last_size:
+                    record["bytes"] = size
+                    return new_file
+                last_size = size
+                time.sleep(0.1)
+                continue
+            wait_for_directory_change(directory, max(0.0, min(1.0, deadline - time.time())))
+        record["status"] = "timeout"
     return None
 
-def itemlistscraper():
-    def get_latest_file_with_item_name(directory, timeout=60):
-        start_time = time.time()
-        while (time.time() - start_time) < timeout:
-            for file_name in os.listdir(directory):
-                if "Item" in file_name and file_name.endswith(".xlsx"):
-                    return os.path.join(directory, file_name)
-            time.sleep(1)
-        return None
+# The ReportViewer control signals an in-flight postback through the ASP.NET AJAX client API;
+# older viewers only show the AsyncWait overlay, so fall back to that
+REPORT_VIEWER_IDLE_SCRIPT = """
+if (document.readyState !== 'complete') { return false; }
+if (window.Sys && Sys.WebForms && Sys.WebForms.PageRequestManager) {
+    var prm = Sys.WebForms.PageRequestManager.getInstance();
+    if (prm && prm.get_isInAsyncPostBack()) { return false; }
+}
+if (window.$find) {
+    var viewer = $find('ReportViewerControl');
+    if (viewer && viewer.get_isLoading && viewer.get_isLoading()) { return false; }
+}
+var spinner = document.getElementById('ReportViewerControl_AsyncWait');
+return !spinner || spinner.offsetParent === null;
+"""
 
-    try:
-        item_url = "http://hffsuk02/Reports/report/ReportsUK/Item/ItemListMDeptWC"
-        logger.debug(f"Starting itemlistscraper with URL: {item_url}")
-        options = configure_options()
-        driver = webdriver.Chrome(options=options)
-        wait = WebDriverWait(driver, 30)
+def report_viewer_idle(driver):
+    return driver.execute_script(REPORT_VIEWER_IDLE_SCRIPT)
 
-        driver.get(item_url)
-        driver.fullscreen_window()
-        time.sleep(5)
+def open_report_viewer(driver, url, timeout=60):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException
 
-        frames = driver.find_elements(By.TAG_NAME, "iframe")
-        if frames:
-            driver.switch_to.frame(frames[0])
+    with stage("selenium.open_report", url=url):
+        driver.get(url)
+        driver.fullscreen_window()
+        wait = WebDriverWait(driver, timeout, poll_frequency=0.25)
+        try:
+            wait.until(EC.frame_to_be_available_and_switch_to_it((By.TAG_NAME, "iframe")))
             logger.debug("Navigated to frame")
+        except TimeoutException:
+            logger.debug("No report frame found, using the top-level page")
+        wait.until(report_viewer_idle)
+    return wait
+
+def click_when_ready(driver, wait, locator, step):
+    from selenium.webdriver.support import expected_conditions as EC
+
+    with stage(f"selenium.{step}"):
+        element = wait.until(EC.element_to_be_clickable(locator))
+        driver.execute_script("arguments[0].scrollIntoView(true);", element)
+        driver.execute_script("arguments[0].click();", element)
+        wait.until(report_viewer_idle)
+
+def export_report_to_excel(driver, wait, download_dir, timeout=120):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    initial_files = set(os.listdir(download_dir))
+    click_when_ready(driver, wait, (By.CSS_SELECTOR, "#ReportViewerControl_ctl05_ctl04_ctl00_ButtonImg"), "export_menu")
+    with stage("selenium.export_excel"):
+        menu_item = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "#ReportViewerControl_ctl05_ctl04_ctl00_Menu > div:nth-child(2) > a")))
+        driver.execute_script("arguments[0].click();", menu_item)
+    logger.info("Download initiated")
+    return wait_for_download(download_dir, initial_files, timeout)
 
-        dropdown_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[@id='ReportViewerControl_ctl04_ctl03_ctl01']")))
-        driver.execute_script("arguments[0].click();", dropdown_button)
-        time.sleep(4)
-
-        select_all_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "#ReportViewerControl_ctl04_ctl03_divDropDown_ctl00")))
-        driver.execute_script("arguments[0].click();", select_all_button)
-        time.sleep(2)
-
-        view_report_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "#ReportViewerControl_ctl04_ctl00")))
-        driver.execute_script("arguments[0].click();", view_report_button)
-        time.sleep(18)
+def itemlistscraper():
+    from selenium.webdriver.common.by import By
 
-        excel_dropdown_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "#ReportViewerControl_ctl05_ctl04_ctl00_ButtonImg")))
-        driver.execute_script("arguments[0].click();", excel_dropdown_button)
-        time.sleep(3)
+    try:
+        item_url = "http://hffsuk02/Reports/report/ReportsUK/Item/ItemListMDeptWC"
+        logger.debug(f"Starting itemlistscraper with URL: {item_url}")
+        download_dir = report_download_dir("itemlist")
+        with get_driver_pool().session(download_dir) as driver:
+            wait = open_report_viewer(driver, item_url)
 
-        excel_download_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "#ReportViewerControl_ctl05_ctl04_ctl00_Menu > div:nth-child(2) > a")))
-        driver.execute_script("arguments[0].click();", excel_download_button)
-        logger.info("Download initiated")
+            click_when_ready(driver, wait, (By.XPATH, "//button[@id='ReportViewerControl_ctl04_ctl03_ctl01']"), "parameter_dropdown")
+            click_when_ready(driver, wait, (By.CSS_SELECTOR, "#ReportViewerControl_ctl04_ctl03_divDropDown_ctl00"), "select_all")
+            click_when_ready(driver, wait, (By.CSS_SELECTOR, "#ReportViewerControl_ctl04_ctl00"), "view_report")
 
-        latest_file = get_latest_file_with_item_name(downloads_dir)
-        driver.quit()
+            latest_file = export_report_to_excel(driver, wait, download_dir)
 
         if latest_file:
             logger.info(f"File downloaded successfully: {latest_file}")
-            df = pd.read_excel(latest_file)
-            return df
+            return latest_file
         else:
             logger.warning("No new file was downloaded")
             return None
     except Exception as e:
         logger.error(f"Error in itemlistscraper: {e}", exc_info=True)
-        if 'driver' in locals():
-            driver.quit()
         return None
 
 def codedatescraper():
     try:
         codate_url = "http://hffsuk02/Reports/report/ReportsUK/Customer/CoDate2-X"
         logger.debug(f"Starting codedatescraper with URL: {codate_url}")
-        options = configure_options()
-        driver = webdriver.Chrome(options=options)
-        wait = WebDriverWait(driver, 20)
-
-        driver.get(codate_url)
-        driver.fullscreen_window()
-        time.sleep(10)
-
-        frames = driver.find_elements(By.TAG_NAME, "iframe")
-        if frames:
-            driver.switch_to.frame(frames[0])
-            logger.debug("Navigated to frame")
-
-        dropdown_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "#ReportViewerControl_ctl05_ctl04_ctl00_ButtonImg")))
-        driver.execute_script("arguments[0].scrollIntoView(true);", dropdown_button)
-        time.sleep(5)
-        driver.execute_script("arguments[0].click();", dropdown_button)
-        time.sleep(10)
-
-        excel_download_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "#ReportViewerControl_ctl05_ctl04_ctl00_Menu > div:nth-child(2) > a")))
-        driver.execute_script("arguments[0].scrollIntoView(true);", excel_download_button)
-        time.sleep(1)
-        driver.execute_script("arguments[0].click();", excel_download_button)
-        time.sleep(15)
-        logger.info("Download initiated")
-
-        latest_file = None
-        attempt_time = 0
-        while not latest_file and attempt_time < 60:
-            logger.debug(f"Attempt {attempt_time + 1}: Checking for the latest file")
-            latest_file = get_latest_file_path(downloads_dir)
-            time.sleep(1)
-            attempt_time += 1
-
-        driver.quit()
+        download_dir = report_download_dir("codate")
+        with get_driver_pool().session(download_dir) as driver:
+            wait = open_report_viewer(driver, codate_url)
+            latest_file = export_report_to_excel(driver, wait, download_dir)
 
         if latest_file:
             logger.info(f"File downloaded successfully: {latest_file}")
-            df = pd.read_excel(latest_file)
-            return df
+            return latest_file
         else:
             logger.warning("No new file was downloaded")
             return None
     except Exception as e:
         logger.error(f"Error in codedatescraper: {e}", exc_info=True)
-        if 'driver' in locals():
-            driver.quit()
         return None
 
-def file_analysis(codate_df, itemlist_df, cell_run_df):
-    df_codate = pd.DataFrame(codate_df)
-    df_itemlist = pd.DataFrame(itemlist_df)
-    df_cell_run = pd.DataFrame(cell_run_df)
-
-    print("Initial CoDate DataFrame:")
-    print(df_codate.head())
+# Direct SSRS URL-access export. The report server renders the file itself, so no browser,
+# rendering or download folder polling is involved. Credentials come from the environment.
+SSRS_SERVER_URL = os.environ.get("RUNRATES_SSRS_URL", "http://hffsuk02/ReportServer")
+# "auto" tries the direct export first and falls back to the browser, "direct"/"browser" force one path
+REPORT_SOURCE = os.environ.get("RUNRATES_REPORT_SOURCE", "auto")
+REPORT_FORMAT_EXTENSIONS = {"EXCELOPENXML": ".xlsx", "CSV": ".csv"}
+
+_report_session = None
+_report_session_lock = threading.Lock()
+
+def get_report_session():
+    global _report_session
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    with _report_session_lock:
+        if _report_session is None:
+            session = requests.Session()
+            # NTLM authenticates the connection rather than the request, so keep-alive pooling
+            # also saves the three-leg handshake on every export after the first
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4,
+                                  max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504)))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            user = os.environ.get("RUNRATES_NTLM_USER")
+            if user:
+                from requests_ntlm import HttpNtlmAuth
+                session.auth = HttpNtlmAuth(user, os.environ.get("RUNRATES_NTLM_PASSWORD", ""))
+            _report_session = session
+    return _report_session
+
+def direct_export_configured():
+    return "RUNRATES_NTLM_USER" in os.environ or "RUNRATES_SSRS_URL" in os.environ
+
+def download_report_direct(name, download_dir=None, report_format="EXCELOPENXML", timeout=(10, 300)):
+    report = REPORTS[name]
+    url = f"{SSRS_SERVER_URL}?{quote(report['path'])}"
+    params = {"rs:Command": "Render", "rs:Format": report_format}
+    params.update(report["params"])
+    logger.debug(f"Exporting {name} directly from {url} as {report_format}")
+
+    with stage("direct_export", report=name), get_report_session().get(url, params=params, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        # SSRS answers parameter and permission problems with an HTML page rather than an error status
+        if response.headers.get("Content-Type", "").startswith("text/html"):
+            raise ValueError(f"Report server returned an HTML page instead of the {name} export")
+
+        if download_dir is None:
+            buffer = BytesIO()
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                check_cancelled()
+                buffer.write(chunk)
+            buffer.seek(0)
+            return buffer
+
+        file_path = os.path.join(download_dir, f"{report['file_name']}{REPORT_FORMAT_EXTENSIONS[report_format]}")
+        partial_path = file_path + ".part"
+        with open(partial_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                check_cancelled()
+                f.write(chunk)
+        os.replace(partial_path, file_path)
+
+    logger.info(f"File downloaded successfully: {file_path}")
+    return file_path
+
+def parse_promship(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    return pd.to_datetime(values, format='%d-%b-%y')
+
+def report_sidecar_path(name, source):
+    # The projection is part of the name so a change to REPORTS columns never reads a stale sidecar
+    columns = json.dumps(REPORTS[name]["columns"], sort_keys=True).encode()
+    return f"{os.path.splitext(source)[0]}.{hashlib.sha256(columns).hexdigest()[:8]}.parquet"
+
+def read_report_file(name, source):
+    columns = REPORTS[name]["columns"]
+    sidecar = report_sidecar_path(name, source) if isinstance(source, str) and PYARROW_AVAILABLE else None
+    if sidecar and os.path.exists(sidecar):
+        try:
+            with stage("parse.sidecar", report=name) as record:
+                df = pd.read_parquet(sidecar, memory_map=True)
+                record["rows"] = len(df)
+            return df
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable {name} sidecar {sidecar}: {e}")
+
+    # Only the columns the analysis uses are parsed, with their types fixed up front
+    dtypes = {column: dtype for column, dtype in columns.items() if dtype != "date"}
+    usecols = lambda column: column in columns
+    with stage("parse.report", report=name) as record:
+        if isinstance(source, str) and source.endswith(".csv"):
+            df = pd.read_csv(source, usecols=usecols, dtype=dtypes)
+        else:
+            df = pd.read_excel(source, usecols=usecols, dtype=dtypes, engine="calamine" if CALAMINE_AVAILABLE else None)
+        record["rows"] = len(df)
 
-    print("Initial ItemList DataFrame:")
-    print(df_itemlist.head())
+    for column, dtype in columns.items():
+        if dtype == "date" and column in df.columns:
+            df[column] = parse_promship(df[column])
 
-    print("Initial Cell Run DataFrame:")
-    print(df_cell_run.head())
+    if sidecar:
+        try:
+            df.to_parquet(sidecar, index=False)
+        except Exception as e:
+            logger.warning(f"Could not write {name} sidecar {sidecar}: {e}")
+    return df
+
+ALERT_THRESHOLD = 4000
+
+AnalysisResult = namedtuple('AnalysisResult', [
+    'codate', 'itemlist', 'cell_run', 'critical',
+    'per_buyer', 'per_part', 'per_buyer_codate', 'per_part_codate',
+])
+
+# Key columns share one categorical dictionary per kind of key across both reports, so the groupbys,
+# the run-rate lookups and the 8xx cell filter all work on small integer codes
+KEY_DOMAINS = {'Buyer': 'cell', 'Item Number': 'item', 'Parent': 'item', 'CustID': 'customer'}
+# Only columns that are summed are downcast; WCRMins and OrderQty are multiplied together, and a small
+# integer type would wrap around there
+DOWNCAST_COLUMNS = ('Quantity',)
+
+def is_categorical(values):
+    return isinstance(values.dtype, pd.CategoricalDtype)
+
+def key_mask(values, predicate):
+    # A string test on categorical keys runs once per category rather than once per row
+    if is_categorical(values):
+        matches = np.append(predicate(values.cat.categories.to_series()).to_numpy(dtype=bool), False)
+        return matches[values.cat.codes.to_numpy()]
+    return predicate(values).to_numpy(dtype=bool)
+
+def lookup(keys, table):
+    # Maps keys through a Series indexed by key; categorical keys look each category up once
+    if is_categorical(keys):
+        values = np.append(table.reindex(keys.cat.categories).to_numpy(dtype='float64'), np.nan)
+        return values[keys.cat.codes.to_numpy()]
+    return keys.map(table).to_numpy(dtype='float64')
+
+def downcast_exact(values):
+    # Whole numbers go to the smallest integer type that holds them. Fractional columns stay float64,
+    # since float32 would change the minute totals.
+    if not pd.api.types.is_float_dtype(values.dtype):
+        return values
+    array = values.to_numpy()
+    if not (np.isfinite(array).all() and np.array_equal(array, np.round(array))):
+        return values
+    return pd.to_numeric(values.astype('int64'), downcast='integer')
+
+def key_codes(values):
+    if is_categorical(values):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    codes, uniques = pd.factorize(values)
+    return codes, pd.Index(uniques)
+
+def compact_reports(*frames):
+    # Each key column is factorised once; only its distinct values are then looked up in the shared
+    # dictionary, and the row codes are remapped with a single take
+    keys = [{column: key_codes(df[column]) for column in KEY_DOMAINS if column in df.columns} for df in frames]
+    categories = {}
+    for columns in keys:
+        for column, (_, uniques) in columns.items():
+            categories.setdefault(KEY_DOMAINS[column], []).append(uniques)
+    # Sorted dictionaries keep sorted groupbys in the same order as on plain strings
+    dtypes = {domain: pd.CategoricalDtype(found[0].append(found[1:]).unique().sort_values()) for domain, found in categories.items()}
+
+    compacted = []
+    for df, columns in zip(frames, keys):
+        converted = {}
+        for column, (codes, uniques) in columns.items():
+            dtype = dtypes[KEY_DOMAINS[column]]
+            remap = np.append(dtype.categories.get_indexer(uniques), -1)
+            converted[column] = pd.Categorical.from_codes(remap[codes], dtype=dtype)
+        converted.update({column: downcast_exact(df[column]) for column in DOWNCAST_COLUMNS if column in df.columns})
+        compacted.append(df.assign(**converted))
+    return compacted
+
+def alert_totals(totals, value):
+    totals = totals.rename(value).sort_values(ascending=False, kind='stable').reset_index()
+    totals['Alert'] = np.where(totals[value].to_numpy() > ALERT_THRESHOLD, 'Alert', '')
+    return totals
+
+def grouped_totals(df, key, value):
+    # One grouped pass per key; the alert flag is a single vectorised comparison
+    return alert_totals(df.groupby(key, sort=False, observed=True)[value].sum(), value)
+
+def clean_itemlist(itemlist_df):
+    return itemlist_df[itemlist_df['Quantity'].notna()]
+
+def add_itemlist_minutes(itemlist, quantity_per_buyer):
+    return itemlist.assign(
+        MinutesOfJob=itemlist['Quantity'],
+        TotalMinutesOfJob=lookup(itemlist['Buyer'], quantity_per_buyer),
+    )
 
-    if 'Item Number' not in df_codate.columns:
+def clean_codate(codate_df):
+    return codate_df[codate_df['CustID'].notna()] if 'CustID' in codate_df.columns else codate_df
+
+def cell_lines(codate):
+    # Cut down to the 8xx cells before any sorting or lookups, so they only touch the rows that matter
+    lines = codate[key_mask(codate['Buyer'], lambda cells: cells.str.startswith('8', na=False))]
+    if 'PromShip' in lines.columns:
+        lines = lines.assign(PromShip=parse_promship(lines['PromShip']))
+    return lines
+
+def add_cell_load(lines, cell_run_df, daily_run_rates):
+    minutes = lines['WCRMins'].to_numpy(dtype='float64') * lines['OrderQty'].to_numpy(dtype='float64')
+    daily_rate = lookup(lines['Buyer'], pd.Series(daily_run_rates, dtype='float64'))
+    return lines.assign(**{
+        'Run Rate': lookup(lines['Item Number'], cell_run_df['Run Rate']),
+        'MinutesOfJob': minutes,
+        'Daily Cell Run Rate': daily_rate,
+        'ExceedsHalfaDaysWork': minutes > 0.5 * daily_rate,
+    })
+
+def check_analysis_inputs(codate_df, cell_run_df):
+    if 'Item Number' not in codate_df.columns:
         raise KeyError("'Item Number' column is missing in codate DataFrame.")
-    if 'Run Rate' not in df_cell_run.columns:
+    if 'Run Rate' not in cell_run_df.columns:
         raise KeyError("'Run Rate' column is missing in cell run DataFrame.")
 
-    df_cell_run = df_cell_run.reset_index().rename(columns={'index': 'Item Number'})
-
-    print("Cell Run DataFrame after resetting index:")
-    print(df_cell_run.head())
-
-    df_codate_cleaned = df_codate.dropna(subset=['CustID']) if 'CustID' in df_codate.columns else df_codate
-    df_itemlist_cleaned = df_itemlist.dropna(subset=['Quantity'])
-
-    print("Cleaned CoDate DataFrame:")
-    print(df_codate_cleaned.head())
-
-    print("Cleaned ItemList DataFrame:")
-    print(df_itemlist_cleaned.head())
-
-    df_itemlist_cleaned['MinutesOfJob'] = df_itemlist_cleaned['Quantity']
-    df_itemlist_cleaned['TotalMinutesOfJob'] = df_itemlist_cleaned.groupby('Buyer')['MinutesOfJob'].transform('sum')
-
-    total_quantity_per_buyer = df_itemlist_cleaned.groupby('Buyer')['Quantity'].sum().reset_index()
-    total_quantity_per_part = df_itemlist_cleaned.groupby('Parent')['Quantity'].sum().reset_index()
-
-    print("Total Quantity per Buyer:")
-    print(total_quantity_per_buyer.head())
-
-    print("Total Quantity per Part:")
-    print(total_quantity_per_part.head())
-
-    total_quantity_per_buyer_codate = df_codate_cleaned.groupby('Buyer')['WCRMins'].sum().reset_index()
-    total_quantity_per_part_codate = df_codate_cleaned.groupby('Item Number')['WCRMins'].sum().reset_index()
-
-    print("Total Quantity per Buyer CoDate:")
-    print(total_quantity_per_buyer_codate.head())
-
-    print("Total Quantity per Part CoDate:")
-    print(total_quantity_per_part_codate.head())
-
-    total_quantity_per_buyer['Alert'] = total_quantity_per_buyer['Quantity'].apply(lambda x: 'Alert' if x > 4000 else '')
-    total_quantity_per_part['Alert'] = total_quantity_per_part['Quantity'].apply(lambda x: 'Alert' if x > 4000 else '')
-    total_quantity_per_buyer_codate['Alert'] = total_quantity_per_buyer_codate['WCRMins'].apply(lambda x: 'Alert' if x > 4000 else '')
-    total_quantity_per_part_codate['Alert'] = total_quantity_per_part_codate['WCRMins'].apply(lambda x: 'Alert' if x > 4000 else '')
-
-    total_quantity_per_buyer = total_quantity_per_buyer.sort_values(by='Quantity', ascending=False)
-    total_quantity_per_part = total_quantity_per_part.sort_values(by='Quantity', ascending=False)
-    total_quantity_per_buyer_codate = total_quantity_per_buyer_codate.sort_values(by='WCRMins', ascending=False)
-    total_quantity_per_part_codate = total_quantity_per_part_codate.sort_values(by='WCRMins', ascending=False)
-
-    if 'PromShip' in df_codate_cleaned.columns:
-        df_codate_cleaned['PromShip'] = pd.to_datetime(df_codate_cleaned['PromShip'], format='%d-%b-%y')
-    df_codate_cleaned = df_codate_cleaned.sort_values(by='PromShip', ascending=True)
-    df_codate_cleaned = df_codate_cleaned[df_codate_cleaned['Buyer'].str.startswith('8')]
-
-    df_codate_cleaned = pd.merge(df_codate_cleaned, df_cell_run, on='Item Number', how='left')
+def analyse_orders(codate_df, itemlist_df, cell_run_df, daily_run_rates):
+    # Pure analysis step: takes the two reports and the run rates and returns every output table
+    # without touching the inputs, the disk or the screen
+    check_analysis_inputs(codate_df, cell_run_df)
+    cell_run = cell_run_df.rename_axis('Item Number').reset_index()
+
+    with stage("analysis.clean", rows=len(codate_df) + len(itemlist_df)):
+        itemlist = clean_itemlist(itemlist_df)
+        codate = clean_codate(codate_df)
+
+    with stage("analysis.itemlist_totals", rows=len(itemlist)):
+        quantity_per_buyer = itemlist.groupby('Buyer', sort=False, observed=True)['Quantity'].sum()
+        itemlist = add_itemlist_minutes(itemlist, quantity_per_buyer)
+        per_buyer = alert_totals(quantity_per_buyer, 'Quantity')
+        per_part = grouped_totals(itemlist, 'Parent', 'Quantity')
+
+    with stage("analysis.codate_totals", rows=len(codate)):
+        per_buyer_codate = grouped_totals(codate, 'Buyer', 'WCRMins')
+        per_part_codate = grouped_totals(codate, 'Item Number', 'WCRMins')
+
+    with stage("analysis.cell_load") as record:
+        lines = cell_lines(codate)
+        if 'PromShip' in lines.columns:
+            lines = lines.sort_values(by='PromShip', ascending=True, kind='stable')
+        lines = add_cell_load(lines, cell_run_df, daily_run_rates).reset_index(drop=True)
+        record["rows"] = len(lines)
+
+    with stage("analysis.critical_filter") as record:
+        critical = lines[lines['ExceedsHalfaDaysWork'].to_numpy()]
+        record["rows"] = len(critical)
+
+    return AnalysisResult(lines, itemlist, cell_run, critical, per_buyer, per_part, per_buyer_codate, per_part_codate)
+
+# What-if run rates: a scenario only names the cells whose rate it changes, every other cell keeps
+# the current rate. The current rates are always compared as the first scenario.
+BASE_SCENARIO = 'Current'
+
+def load_scenarios_file(path):
+    # CSV of scenario,cell,rate, one row per changed cell
+    df = pd.read_csv(path, dtype={0: str, 1: str})
+    scenarios = {}
+    for scenario, cell, rate in zip(df.iloc[:, 0].str.strip(), df.iloc[:, 1].str.strip(), df.iloc[:, 2].astype(float)):
+        scenarios.setdefault(scenario, {})[cell] = rate
+    return scenarios
+
+def scenario_rate_matrix(scenarios, daily_run_rates):
+    # cells x scenarios of daily run rates
+    daily_run_rates = dict(daily_run_rates)
+    names = [BASE_SCENARIO] + [name for name in scenarios if name != BASE_SCENARIO]
+    cells = list(daily_run_rates)
+    cells += list(dict.fromkeys(cell for overrides in scenarios.values() for cell in overrides if cell not in daily_run_rates))
+    base = np.array([daily_run_rates.get(cell, np.nan) for cell in cells], dtype='float64')
+    matrix = np.repeat(base[:, None], len(names), axis=1)
+    rows = {cell: i for i, cell in enumerate(cells)}
+    for column, name in enumerate(names):
+        for cell, rate in scenarios.get(name, {}).items():
+            matrix[rows[cell], column] = rate
+    return pd.DataFrame(matrix, index=pd.Index(cells, name='Cell'), columns=names)
+
+def compare_scenarios(lines, rate_matrix):
+    # One pass over the cell lines for any number of scenarios. Each cell's job minutes are sorted
+    # once; a line is critical when it takes more than half the scenario's daily rate, so a cell's
+    # critical lines are a suffix of its sorted minutes, found by one binary search per scenario.
+    codes = pd.Categorical(lines['Buyer'], categories=rate_matrix.index).codes
+    minutes = lines['MinutesOfJob'].to_numpy(dtype='float64')
+    keep = (codes >= 0) & ~np.isnan(minutes)
+    codes, minutes = codes[keep], minutes[keep]
+    order = np.lexsort((minutes, codes))
+    codes, minutes = codes[order], minutes[order]
+
+    bounds = np.searchsorted(codes, np.arange(len(rate_matrix) + 1))
+    cumulative = np.concatenate(([0.0], np.cumsum(minutes)))
+    rates = rate_matrix.to_numpy()
+    thresholds = 0.5 * rates
+    critical_lines = np.zeros(rates.shape, dtype='int64')
+    critical_minutes = np.zeros(rates.shape)
+    for cell in np.flatnonzero(np.diff(bounds)):
+        start, end = bounds[cell], bounds[cell + 1]
+        # An unknown rate (NaN) sorts past every line, so it flags nothing, as in add_cell_load
+        cut = start + np.searchsorted(minutes[start:end], thresholds[cell], side='right')
+        critical_lines[cell] = end - cut
+        critical_minutes[cell] = cumulative[end] - cumulative[cut]
+
+    load = np.diff(cumulative[bounds])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_work = np.where(rates > 0, load[:, None] / rates, np.nan)
+    columns = {'Cell': rate_matrix.index, 'Order Lines': np.diff(bounds), 'Load (min)': load}
+    for i, name in enumerate(rate_matrix.columns):
+        columns[f'{name} Run Rate'] = rates[:, i]
+        columns[f'{name} Days of Work'] = days_of_work[:, i]
+        columns[f'{name} Critical Lines'] = critical_lines[:, i]
+        columns[f'{name} Critical Minutes'] = critical_minutes[:, i]
+    comparison = pd.DataFrame(columns)
+    comparison = comparison[comparison['Order Lines'].to_numpy() > 0]
+
+    totals = {column: comparison[column].sum() for column in comparison.columns
+              if column in ('Order Lines', 'Load (min)') or column.endswith(('Critical Lines', 'Critical Minutes'))}
+    return pd.concat([comparison, pd.DataFrame([{'Cell': 'All cells', **totals}])], ignore_index=True)
+
+# Capacity forecast: each cell works through its orders in PromShip order at its daily run rate,
+# starting today, on working days (Monday to Friday). Lines of cells with no run rate, or that would
+# take longer than the horizon to reach, are late with no projected date.
+CAPACITY_HORIZON_DAYS = 5 * 260
+CapacityForecast = namedtuple('CapacityForecast', ['lines', 'cells', 'timeline', 'late'])
+
+def capacity_forecast(lines, start=None):
+    # lines are the cell lines as analyse_orders returns them, already sorted by PromShip
+    start = np.datetime64(start or datetime.now().date(), 'D')
+    cells = lines['Buyer'].array
+    minutes = np.nan_to_num(lines['MinutesOfJob'].to_numpy(dtype='float64'))
+    rate = lines['Daily Cell Run Rate'].to_numpy(dtype='float64')
+    promship = lines['PromShip'].to_numpy().astype('datetime64[D]')
+
+    cumulative = pd.Series(minutes).groupby(cells, sort=False, observed=True).cumsum().to_numpy()
+    has_capacity = rate > 0
+    # A line finishes on the working day its cell's running total is worked off; day one is today
+    days = np.full(len(lines), np.inf)
+    days[has_capacity] = np.ceil(cumulative[has_capacity] / rate[has_capacity])
+    finishes = days <= CAPACITY_HORIZON_DAYS
+    completion = np.full(len(lines), np.datetime64('NaT'), dtype='datetime64[D]')
+    completion[finishes] = np.busday_offset(start, np.maximum(days[finishes] - 1, 0).astype('int64'), roll='forward')
+
+    late = ~finishes | (completion > promship)
+    dated = late & finishes & ~np.isnat(promship)
+    days_late = np.full(len(lines), np.nan)
+    days_late[dated] = np.busday_count(promship[dated], completion[dated])
+
+    projected = lines.assign(**{
+        'Cumulative Cell Load': cumulative,
+        'Projected Completion': completion,
+        'Working Days Late': days_late,
+        'Late': late,
+    })
+
+    per_cell = pd.DataFrame({
+        'Cell': cells,
+        'Order Lines': 1,
+        'Load (min)': minutes,
+        'Late Lines': late,
+        'Late Load (min)': np.where(late, minutes, 0.0),
+        'Projected Clear Date': completion,
+        'Unprojected Lines': ~finishes,
+    }).groupby('Cell', sort=True, observed=True).agg({
+        'Order Lines': 'sum', 'Load (min)': 'sum', 'Late Lines': 'sum', 'Late Load (min)': 'sum', 'Projected Clear Date': 'max',
+        'Unprojected Lines': 'sum',
+    })
+    # max skips NaT, so a cell whose tail runs past the horizon would otherwise show a finite clear date
+    per_cell.loc[per_cell.pop('Unprojected Lines').to_numpy() > 0, 'Projected Clear Date'] = pd.NaT
+    cell_rates = pd.Series(rate, index=cells).groupby(level=0, sort=True, observed=True).first()
+    per_cell.insert(2, 'Daily Cell Run Rate', cell_rates)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_cell.insert(3, 'Working Days to Clear', np.where(cell_rates > 0, per_cell['Load (min)'] / cell_rates, np.nan))
+
+    # Load due on each promise date against the capacity available by the end of that day;
+    # dates already past have no capacity left, so overdue load shows as a shortfall. Lines with no
+    # PromShip form a last, undated row per cell with no capacity figure, so the totals still match
+    # the Cell Capacity sheet.
+    timeline = pd.DataFrame({
+        'Cell': cells,
+        'PromShip': promship,
+        'Order Lines': 1,
+        'Load Due (min)': minutes,
+        'Late Lines': late,
+    }).groupby(['Cell', 'PromShip'], sort=True, observed=True, dropna=False).sum()
+    timeline.insert(2, 'Cumulative Load (min)', timeline.groupby(level='Cell', sort=False, observed=True)['Load Due (min)'].cumsum())
+    due_dates = timeline.index.get_level_values('PromShip').to_numpy().astype('datetime64[D]')
+    dated = ~np.isnat(due_dates)
+    working_days = np.full(len(due_dates), np.nan)
+    working_days[dated] = np.maximum(np.busday_count(start, due_dates[dated] + np.timedelta64(1, 'D')), 0)
+    capacity = cell_rates.reindex(timeline.index.get_level_values('Cell')).to_numpy() * working_days
+    timeline.insert(3, 'Capacity to Date (min)', capacity)
+    timeline.insert(4, 'Surplus (min)', capacity - timeline['Cumulative Load (min)'].to_numpy())
+
+    return CapacityForecast(projected, per_cell.reset_index(), timeline.reset_index(), projected[late])
+
+def order_line_keys(df):
+    # The reports carry no line id, so an order line is keyed by its content. Identical lines are
+    # told apart by their occurrence number, which keeps duplicates as separate entries.
+    row_hash = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    keys = pd.Index(row_hash, name='line')
+    if keys.is_unique:
+        return keys
+    occurrence = pd.Series(row_hash).groupby(row_hash, sort=False).cumcount().to_numpy().astype('uint64')
+    # A multiply-add mixes the occurrence in without hashing the whole book a second time
+    return pd.Index(row_hash + occurrence * np.uint64(0x9E3779B97F4A7C15), name='line')
+
+class IncrementalAnalysis:
+    # Lists what changed in CoDate since the last run: lines added and removed, and unchanged lines
+    # that became or stopped being critical after a run-rate edit. Every output table still needs the
+    # whole book, so the analysis itself is the full one; between runs only the cleaned CoDate (for
+    # the removed lines) and a flag per line saying whether it was critical are kept.
+    STATE_VERSION = 2
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.state_path = os.path.join(state_dir, "analysis_state.pkl")
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return None
+        try:
+            return pd.read_pickle(self.state_path)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable analysis state: {e}")
+            return None
 
-    print("Merged CoDate DataFrame with Cell Run DataFrame:")
-    print(df_codate_cleaned.head())
+    def save_state(self, state):
+        if not os.path.exists(self.state_dir):
+            os.makedirs(self.state_dir)
+        temp_path = self.state_path + ".tmp"
+        pd.to_pickle(state, temp_path)
+        os.replace(temp_path, self.state_path)
+
+    def update(self, codate_df, itemlist_df, cell_run_df, daily_run_rates):
+        result = analyse_orders(codate_df, itemlist_df, cell_run_df, daily_run_rates)
+
+        with stage("analysis.incremental_keys", rows=len(codate_df)):
+            codate = clean_codate(codate_df).reset_index(drop=True)
+            lines = add_cell_load(cell_lines(codate), cell_run_df, daily_run_rates)
+            critical = np.zeros(len(codate), dtype=bool)
+            critical[lines.index[lines['ExceedsHalfaDaysWork'].to_numpy()]] = True
+            codate = codate.set_axis(order_line_keys(codate))
+
+        with stage("analysis.incremental_load_state"):
+            state = self.load_state()
+        columns = ['Change'] + list(codate.columns)
+        if (not isinstance(state, dict) or state.get('version') != self.STATE_VERSION
+                or list(state['codate'].columns) != list(codate.columns)
+                or not (state['codate'].index.is_unique and codate.index.is_unique)):
+            logger.info("No compatible previous snapshot; changes are listed from the next run")
+            changes = pd.DataFrame(columns=columns)
+        else:
+            with stage("analysis.incremental_changes", rows=len(codate)) as record:
+                changes = self.changes(state, codate, critical)[columns]
+                record["changed_lines"] = len(changes)
+
+        with stage("analysis.incremental_save_state"):
+            self.save_state({'version': self.STATE_VERSION, 'codate': codate, 'critical': critical})
+        return result, changes
+
+    def changes(self, state, codate, critical):
+        # One hash lookup of the new keys in the old ones; everything else is positional
+        previous = state['codate']
+        position = previous.index.get_indexer(codate.index)
+        kept = position >= 0
+        still_there = np.zeros(len(previous), dtype=bool)
+        still_there[position[kept]] = True
+        was_critical = np.zeros(len(codate), dtype=bool)
+        was_critical[kept] = state['critical'][position[kept]]
+        added, removed = codate[~kept], previous[~still_there]
+        logger.info(f"CoDate changes since last run: {len(added)} added, {len(removed)} removed")
+        changes = [
+            added.assign(Change='Added'),
+            removed.assign(Change='Removed'),
+            codate[kept & critical & ~was_critical].assign(Change='Now Critical'),
+            codate[kept & ~critical & was_critical].assign(Change='No Longer Critical'),
+        ]
+        changes = [frame for frame in changes if len(frame)]
+        return pd.concat(changes).reset_index(drop=True) if changes else pd.DataFrame(columns=['Change'] + list(codate.columns))
+
+# Sheet order in the workbook; the summary set leaves out the two full report dumps
+FULL_SHEETS = [
+    'CoDate Data',
+    'Item List Data',
+    'Cell Run Rates',
+    'Critical Entries',
+    'Total Quantity per Buyer',
+    'Total Quantity per Part',
+    'Total Quantity per Buyer CoDate',
+    'Total Quantity per Part CoDate',
+    'Changes Since Last Run',
+    'Scenario Comparison',
+    'Cell Capacity',
+    'Cell Capacity Timeline',
+    'Late Orders',
+]
+SHEET_SETS = {
+    'full': FULL_SHEETS,
+    'summary': [sheet for sheet in FULL_SHEETS if sheet not in ('CoDate Data', 'Item List Data')],
+}
+OUTPUT_FORMATS = ('xlsx', 'parquet', 'csv')
+EXCEL_MAX_ROWS = 1048576
+
+def result_sheets(result, changes=None, scenario_comparison=None, forecast=None):
+    sheets = {
+        'CoDate Data': result.codate,
+        'Item List Data': result.itemlist,
+        'Cell Run Rates': result.cell_run,
+        'Critical Entries': result.critical,
+        'Total Quantity per Buyer': result.per_buyer,
+        'Total Quantity per Part': result.per_part,
+        'Total Quantity per Buyer CoDate': result.per_buyer_codate,
+        'Total Quantity per Part CoDate': result.per_part_codate,
+    }
+    if changes is not None:
+        sheets['Changes Since Last Run'] = changes
+    if scenario_comparison is not None:
+        sheets['Scenario Comparison'] = scenario_comparison
+    if forecast is not None:
+        sheets['Cell Capacity'] = forecast.cells
+        sheets['Cell Capacity Timeline'] = forecast.timeline
+        sheets['Late Orders'] = forecast.late
+    return sheets
+
+def excel_rows(df, na_rep='NA', chunk_size=10000):
+    # Rows are converted a chunk at a time so the whole sheet never exists as Python objects
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        columns = []
+        for column in chunk.columns:
+            values = chunk[column]
+            missing = values.isna().to_numpy()
+            if pd.api.types.is_datetime64_any_dtype(values):
+                values = np.array(values.dt.to_pydatetime(), dtype=object)
+            else:
+                values = values.to_numpy(dtype=object)
+            values[missing] = na_rep
+            columns.append(values)
+        yield from zip(*columns)
+
+def write_excel_sheet(workbook, sheet_name, df, header_format, na_rep='NA'):
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, [str(column) for column in df.columns], header_format)
+    for row_number, row in enumerate(excel_rows(df, na_rep), start=1):
+        worksheet.write_row(row_number, 0, row)
+
+def sheet_file_name(sheet_name):
+    return sheet_name.lower().replace(' ', '_')
+
+def write_outputs(sheets, output_dir='.', sheet_set='full', formats=('xlsx',), workbook_name='Item Breakdown.xlsx'):
+    selected = [(name, sheets[name]) for name in SHEET_SETS[sheet_set] if name in sheets]
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    stats = []
+    @contextmanager
+    def sheet_stage(sheet_name, target, df):
+        with stage("write.sheet", rows=len(df), sheet=sheet_name, target=target) as record:
+            yield
+        stats.append(record)
+        peak, growth = record['peak_rss_mb'], record['rss_growth_mb']
+        memory = 'n/a' if peak is None else f'{peak:.0f} MB (+{growth:.1f} MB)'
+        logger.info(f"Wrote {sheet_name} ({len(df)} rows) to {target} in {record['seconds']:.2f}s, peak RSS {memory}")
+
+    paths = []
+    if 'xlsx' in formats:
+        import xlsxwriter
+        workbook_path = os.path.join(output_dir, workbook_name)
+        # constant_memory flushes each row to disk as soon as the next one starts
+        workbook = xlsxwriter.Workbook(workbook_path, {
+            'constant_memory': True,
+            'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+            'nan_inf_to_errors': True,
+        })
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        try:
+            for sheet_name, df in selected:
+                if len(df) >= EXCEL_MAX_ROWS:
+                    logger.warning(f"{sheet_name} has {len(df)} rows, more than an Excel sheet holds; skipped in the workbook, use the parquet or csv output")
+                    continue
+                with sheet_stage(sheet_name, 'xlsx', df):
+                    write_excel_sheet(workbook, sheet_name, df, header_format)
+        finally:
+            workbook.close()
+        paths.append(workbook_path)
+
+    for output_format in formats:
+        if output_format == 'xlsx':
+            continue
+        for sheet_name, df in selected:
+            path = os.path.join(output_dir, f"{sheet_file_name(sheet_name)}.{output_format}")
+            with sheet_stage(sheet_name, output_format, df):
+                if output_format == 'parquet':
+                    df.to_parquet(path, index=False)
+                else:
+                    df.to_csv(path, index=False, na_rep='NA')
+            paths.append(path)
+
+    return paths, stats
+
+def file_analysis(codate_df, itemlist_df, cell_run_df, incremental=False, output_dir='.', sheet_set='full', formats=('xlsx',), open_workbook=True,
+                  scenarios=None):
+    changes = None
+    daily_run_rates = cell_run_df['Run Rate']
+    if incremental:
+        result, changes = IncrementalAnalysis(analysis_state_dir).update(codate_df, itemlist_df, cell_run_df, daily_run_rates)
+    else:
+        result = analyse_orders(codate_df, itemlist_df, cell_run_df, daily_run_rates)
+    logger.info(f"Analysis found {len(result.critical)} critical entries in {len(result.codate)} CoDate lines")
+
+    forecast = None
+    if 'PromShip' in result.codate.columns:
+        with stage("analysis.capacity_forecast", rows=len(result.codate)) as record:
+            forecast = capacity_forecast(result.codate)
+            record["late_lines"] = len(forecast.late)
+        logger.info(f"Capacity forecast: {len(forecast.late)} of {len(result.codate)} cell lines will miss PromShip")
+
+    scenario_comparison = None
+    if scenarios:
+        rate_matrix = scenario_rate_matrix(scenarios, daily_run_rates)
+        with stage("analysis.scenarios", rows=len(result.codate), scenarios=len(rate_matrix.columns)):
+            scenario_comparison = compare_scenarios(result.codate, rate_matrix)
+
+    # Last chance to cancel before the previous workbook is overwritten
+    check_cancelled()
+    paths, _ = write_outputs(result_sheets(result, changes, scenario_comparison, forecast), output_dir, sheet_set, formats)
+    if open_workbook and 'xlsx' in formats and hasattr(os, 'startfile'):
+        os.startfile(paths[0])
+
+    return result.per_buyer, result.per_part, result.per_buyer_codate, result.per_part_codate, result.critical
+
+class ReportCache:
+    # Downloaded reports keyed by report name and parameters. Files are stored under their content
+    # hash, so an unchanged re-export is kept once, and entries are served again within the TTL.
+
+    def __init__(self, directory, ttl=15 * 60, max_bytes=500 * 1024 * 1024, max_age=7 * 24 * 60 * 60):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._index_path = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable report cache index: {e}")
+            return {}
+
+    def _save_index(self):
+        temp_path = self._index_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self._index, f, indent=2)
+        os.replace(temp_path, self._index_path)
+
+    @staticmethod
+    def key(name, params):
+        return hashlib.sha256(json.dumps([name, params], sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def file_hash(file_path):
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get(self, name, params, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            entry = self._index.get(self.key(name, params))
+            if entry is None:
+                return None
+            file_path = os.path.join(self.directory, entry["file"])
+            if time.time() - entry["fetched_at"] > ttl or not os.path.exists(file_path):
+                return None
+            logger.info(f"Using cached {name} report from {datetime.fromtimestamp(entry['fetched_at']):%H:%M:%S}")
+            return file_path
+
+    def put(self, name, params, file_path):
+        content_hash = self.file_hash(file_path)
+        cached_name = content_hash + os.path.splitext(file_path)[1]
+        cached_path = os.path.join(self.directory, cached_name)
+        with self._lock:
+            if os.path.exists(cached_path):
+                os.unlink(file_path)
+            else:
+                shutil.move(file_path, cached_path)
+            self._index[self.key(name, params)] = {
+                "report": name,
+                "params": params,
+                "file": cached_name,
+                "hash": content_hash,
+                "size": os.path.getsize(cached_path),
+                "fetched_at": time.time(),
+            }
+            self._evict()
+            self._save_index()
+        return cached_path
+
+    def _evict(self):
+        now = time.time()
+        for key, entry in list(self._index.items()):
+            if now - entry["fetched_at"] > self.max_age:
+                del self._index[key]
+
+        # Oldest entries go first until the distinct files fit in the size budget
+        entries = sorted(self._index.items(), key=lambda item: item[1]["fetched_at"])
+        sizes = {entry["file"]: entry["size"] for _, entry in entries}
+        while len(entries) > 1 and sum(sizes.values()) > self.max_bytes:
+            key, entry = entries.pop(0)
+            del self._index[key]
+            if all(other["file"] != entry["file"] for _, other in entries):
+                sizes.pop(entry["file"], None)
+
+        # Parquet sidecars share their report's content hash as a file name prefix
+        referenced = {entry["hash"] for entry in self._index.values()}
+        for file in os.listdir(self.directory):
+            if file.split(".")[0] not in referenced and file != os.path.basename(self._index_path):
+                try:
+                    os.unlink(os.path.join(self.directory, file))
+                except Exception as e:
+                    logger.error(f"Error deleting cached report: {e}", exc_info=True)
+
+_report_cache = None
+
+def get_report_cache():
+    global _report_cache
+    if _report_cache is None:
+        _report_cache = ReportCache(cache_dir, ttl=float(os.environ.get("RUNRATES_CACHE_TTL", 15 * 60)))
+    return _report_cache
+
+# Outcome of fetching one report: df is None when every attempt failed, error holds the last failure
+ReportResult = namedtuple('ReportResult', ['name', 'df', 'error', 'attempts', 'elapsed', 'source'])
+
+REPORTS = {
+    "codate": {
+        "path": "/ReportsUK/Customer/CoDate2-X",
+        "file_name": "CoDate2-X",
+        "params": {},
+        "columns": {
+            "Item Number": "str",
+            "CustID": "str",
+            "Buyer": "str",
+            "WCRMins": "float64",
+            "OrderQty": "float64",
+            "PromShip": "date",
+        },
+        "scraper": codedatescraper,
+    },
+    "itemlist": {
+        "path": "/ReportsUK/Item/ItemListMDeptWC",
+        "file_name": "ItemListMDeptWC",
+        # The browser path ticks "Select All" on a multi-value parameter whose report default is not
+        # "all", so an export without it could render a partial list. Direct export stays off until
+        # that parameter is listed here with every value, e.g. {"Dept": ["A", "B"]}; a list is sent
+        # as repeated name=value pairs.
+        "params": {},
+        "direct_export": False,
+        "columns": {
+            "Buyer": "str",
+            "Parent": "str",
+            "Quantity": "float64",
+        },
+        "scraper": itemlistscraper,
+    },
+}
 
-    df_codate_cleaned['MinutesOfJob'] = df_codate_cleaned['WCRMins'] * df_codate_cleaned['OrderQty']
-    df_codate_cleaned['Daily Cell Run Rate'] = df_codate_cleaned['Buyer'].map(cell_run_rates)
-    df_codate_cleaned['ExceedsHalfaDaysWork'] = df_codate_cleaned['MinutesOfJob'] > (0.5 * df_codate_cleaned['Daily Cell Run Rate'])
+def uses_direct_export(name):
+    if not REPORTS[name].get("direct_export", True):
+        return False
+    return REPORT_SOURCE == "direct" or (REPORT_SOURCE == "auto" and direct_export_configured())
 
-    df_critical = df_codate_cleaned[df_codate_cleaned['ExceedsHalfaDaysWork']]
+def download_report(name):
+    if uses_direct_export(name):
+        try:
+            return download_report_direct(name, report_download_dir(name)), "direct"
+        except RunCancelled:
+            raise
+        except Exception as e:
+            # A cancel can also surface as a broken connection; never start a browser after it
+            check_cancelled()
+            if REPORT_SOURCE == "direct":
+                raise
+            logger.warning(f"Direct export of {name} failed, falling back to the browser: {e}")
+    elif REPORT_SOURCE == "direct":
+        raise ValueError(f"The {name} report is not set up for direct export, see its params in REPORTS")
+    return REPORTS[name]["scraper"](), "browser"
+
+def fetch_report(name, attempts=3, retry_delay=5, cached_file=None):
+    with stage("fetch_report", report=name) as record:
+        result = fetch_report_attempts(name, attempts, retry_delay, cached_file)
+        record.update(rows=None if result.df is None else len(result.df), source=result.source,
+                      attempts=result.attempts, status="ok" if result.df is not None else "failed")
+    return result
+
+def fetch_report_attempts(name, attempts, retry_delay, cached_file):
+    # cached_file is the cache hit fetch_reports already looked up, or None to download
+    start_time = time.time()
+    cache = get_report_cache()
+    params = REPORTS[name]["params"]
+    if cached_file:
+        try:
+            return ReportResult(name, read_report_file(name, cached_file), None, 0, time.time() - start_time, "cache")
+        except Exception as e:
+            logger.warning(f"Cached {name} report could not be read, fetching again: {e}")
 
-    print("Critical Entries DataFrame:")
-    print(df_critical.head())
+    error = None
+    for attempt in range(attempts):
+        if cancel_event.is_set():
+            break
+        source = None
+        try:
+            file_path, source = download_report(name)
+            if file_path:
+                file_path = cache.put(name, params, file_path)
+            df = read_report_file(name, file_path) if file_path else None
+        except RunCancelled:
+            break
+        except Exception as e:
+            logger.error(f"Error fetching {name} report: {e}", exc_info=True)
+            df = None
+            error = str(e)
+        if df is not None:
+            logger.info(f"{name} report loaded from {source} export on attempt {attempt + 1}")
+            return ReportResult(name, df, None, attempt + 1, time.time() - start_time, source)
+        error = error or "no file was downloaded"
+        logger.warning(f"Attempt {attempt + 1} for {name} scraper failed.")
+        if attempt < attempts - 1:
+            # Wakes up early when the run is cancelled
+            cancel_event.wait(retry_delay)
+    if cancel_event.is_set():
+        logger.info(f"Fetching {name} report cancelled")
+        return ReportResult(name, None, "cancelled", attempt + 1, time.time() - start_time, None)
+    return ReportResult(name, None, error, attempts, time.time() - start_time, None)
+
+def fetch_reports(names=("codate", "itemlist"), concurrent=True, attempts=3, refresh=False):
+    names = tuple(names)
+    results = {}
+    # Each report's cache entry is looked up once, here, and the hit handed to its fetch
+    cached = {} if refresh else {name: get_report_cache().get(name, REPORTS[name]["params"]) for name in names}
+    if REPORT_SOURCE != "direct" and any(not cached.get(name) and not uses_direct_export(name) for name in names):
+        get_driver_pool().warm()
+    if not concurrent:
+        for name in names:
+            results[name] = fetch_report(name, attempts, cached_file=cached.get(name))
+        return results
+
+    # Both reports run side by side, so the wall-clock time is that of the slower one
+    with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="report") as executor:
+        futures = {executor.submit(fetch_report, name, attempts, cached_file=cached.get(name)): name for name in names}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.name] = result
+            logger.info(f"{result.name} report finished in {result.elapsed:.1f}s ({'ok' if result.df is not None else 'failed'})")
+    return results
+
+# A report fetch started in the background before the run rates are settled
+Prefetch = namedtuple('Prefetch', ['future', 'metrics', 'started'])
+
+def start_prefetch(reports=("codate", "itemlist"), refresh=False):
+    metrics = start_run_metrics()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+    future = executor.submit(fetch_reports, reports, refresh=refresh)
+    executor.shutdown(wait=False)
+    logger.info("Started fetching reports in the background")
+    return Prefetch(future, metrics, time.time())
+
+def prefetched_results(prefetch):
+    with stage("prefetch_wait") as record:
+        record["waited_for_fetch"] = not prefetch.future.done()
+        results = prefetch.future.result()
+    failed = [name for name, result in results.items() if result.df is None]
+    if failed:
+        logger.warning(f"Background fetch failed for {', '.join(failed)}")
+    return results
+
+def fetch_missing_reports(reports, fetched, concurrent=True, refresh=False):
+    # Reports already fetched by an earlier run or the prefetch are reused; any that are missing or
+    # failed get their full retry budget again
+    results = {name: result for name, result in fetched.items() if name in reports and result.df is not None}
+    if results:
+        logger.info(f"Reusing fetched {', '.join(results)} report(s)")
+    missing = [name for name in reports if name not in results]
+    if missing:
+        check_cancelled()
+        results.update(fetch_reports(missing, concurrent=concurrent, refresh=refresh))
+    return results
+
+def run_pipeline(reports=("codate", "itemlist"), concurrent=True, refresh=False, incremental=False, output_dir='.',
+                 sheet_set='full', formats=('xlsx',), profiler=None, open_workbook=True, prefetch=None, fetched=None,
+                 scenarios=None):
+    # Returns the run status ("ok", "fetched", "fetch_failed", "cancelled" or "error") with the per-report
+    # results, which can be passed back in as fetched= to re-run the analysis without downloading again
+    metrics = prefetch.metrics if prefetch else start_run_metrics()
+    cancel_event.clear()
+    status = "error"
+    results = dict(fetched or {})
+    try:
+        with profiled(profiler, metrics.run_id):
+            if prefetch:
+                results = prefetched_results(prefetch)
+            results = fetch_missing_reports(reports, results, concurrent=concurrent, refresh=refresh)
+            check_cancelled()
+            failed = [result for result in results.values() if result.df is None]
+            if failed:
+                for result in failed:
+                    logger.error(f"{result.name} report failed after {result.attempts} attempts: {result.error}")
+                logger.error("Data processing failed. Check the logs for more information.")
+                status = "fetch_failed"
+            elif "codate" in results and "itemlist" in results:
+                logger.info("Both reports loaded, starting analysis")
+                with stage("compact_reports") as record:
+                    raw_bytes = sum(result.df.memory_usage(deep=True).sum() for result in results.values())
+                    codate, itemlist = compact_reports(results["codate"].df, results["itemlist"].df)
+                    # Re-runs reuse the compact frames, and the raw ones can be freed
+                    results["codate"] = results["codate"]._replace(df=codate)
+                    results["itemlist"] = results["itemlist"]._replace(df=itemlist)
+                    record.update(raw_mb=round(raw_bytes / 1024 ** 2, 1),
+                                  compact_mb=round((codate.memory_usage(deep=True).sum() + itemlist.memory_usage(deep=True).sum()) / 1024 ** 2, 1))
+                logger.info(f"Report frames compacted from {record['raw_mb']} MB to {record['compact_mb']} MB")
+                file_analysis(codate, itemlist, run_rate_frame(), incremental=incremental,
+                              output_dir=output_dir, sheet_set=sheet_set, formats=formats, open_workbook=open_workbook,
+                              scenarios=scenarios)
+                status = "ok"
+            else:
+                # Fetching a single report only refreshes the cache for a later run
+                logger.info(f"Fetched {', '.join(results)}; the analysis needs both reports and was skipped")
+                status = "fetched"
+    except RunCancelled:
+        logger.warning("Run cancelled before it finished")
+        status = "cancelled"
+    except Exception as e:
+        logger.error(f"Error running the pipeline: {e}", exc_info=True)
+    finally:
+        metrics.emit(status)
+    return status, results
+
+def load_data(concurrent=True, refresh=False, incremental=False, output_dir='.', sheet_set='full', formats=('xlsx',), profiler=None,
+              prefetch=None):
+    _, results = run_pipeline(concurrent=concurrent, refresh=refresh, incremental=incremental, output_dir=output_dir,
+                              sheet_set=sheet_set, formats=formats, profiler=profiler, prefetch=prefetch)
+    return results
+
+def parse_run_rates_text(text):
+    # One cell per line, the cell name first and the rate last, as pasted from the live sheet
+    rates = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 2:
+            rates[parts[0]] = float(parts[-1].replace(",", ""))
+    return rates
+
+def load_run_rates_file(path):
+    if path.lower().endswith(".csv"):
+        df = pd.read_csv(path, dtype={0: str})
+        return dict(zip(df.iloc[:, 0].astype(str).str.strip(), df.iloc[:, 1].astype(float)))
+    with open(path) as f:
+        return parse_run_rates_text(f.read())
+
+def set_run_rates(rates, replace=False):
+    if replace:
+        cell_run_rates.clear()
+    cell_run_rates.update(rates)
+
+def load_stored_run_rates(as_of=None):
+    try:
+        rates = get_run_rate_store().rates_as_of(as_of)
+    except Exception as e:
+        logger.error(f"Could not read the run-rate store, using the built-in rates: {e}", exc_info=True)
+        return
+    set_run_rates(rates, replace=True)
+    logger.info(f"Loaded {len(rates)} run rates in force on {(as_of or date.today()).isoformat()}")
 
-    with pd.ExcelWriter('Item Breakdown.xlsx', engine='xlsxwriter') as writer:
-        df_codate_cleaned.to_excel(writer, sheet_name='CoDate Data', index=False, na_rep='NA')
-        df_itemlist_cleaned.to_excel(writer, sheet_name='Item List Data', index=False, na_rep='NA')
-        df_cell_run.to_excel(writer, sheet_name='Cell Run Rates', index=False, na_rep='NA')
-        df_critical.to_excel(writer, sheet_name='Critical Entries', index=False, na_rep='NA')
-        total_quantity_per_buyer.to_excel(writer, sheet_name='Total Quantity per Buyer', index=False, na_rep='NA')
-        total_quantity_per_part.to_excel(writer, sheet_name='Total Quantity per Part', index=False, na_rep='NA')
-        total_quantity_per_buyer_codate.to_excel(writer, sheet_name='Total Quantity per Buyer CoDate', index=False, na_rep='NA')
-        total_quantity_per_part_codate.to_excel(writer, sheet_name='Total Quantity per Part CoDate', index=False, na_rep='NA')
-    
-    os.startfile('Item Breakdown.xlsx')
+def save_run_rates_to_store(rates):
+    try:
+        changed = get_run_rate_store().save(rates)
+        logger.info(f"Saved {changed} changed run rate(s) to {run_rates_path}")
+    except Exception as e:
+        logger.error(f"Could not save run rates: {e}", exc_info=True)
 
-    return total_quantity_per_buyer, total_quantity_per_part, total_quantity_per_buyer_codate, total_quantity_per_part_codate, df_critical
+class QueueLogHandler(logging.Handler):
+    # Hands formatted log lines from any thread to a queue the GUI drains
 
-def load_data():
-    attempts = 3
-    codate_df, itemlist_df = None, None
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
 
-    for attempt in range(attempts):
-        codate_df = codedatescraper()
-        if codate_df is not None:
-            print(f"CoDate DataFrame loaded.")
-            break
-        else:
-            print(f"Attempt {attempt + 1} for CoDate scraper failed.")
-        time.sleep(5)
+    def emit(self, record):
+        try:
+            self.events.put(("log", self.format(record)))
+        except Exception:
+            self.handleError(record)
 
-    for attempt in range(attempts):
-        itemlist_df = itemlistscraper()
-        if itemlist_df is not None:
-            print(f"ItemList DataFrame loaded.")
-            break
-        else:
-            print(f"Attempt {attempt + 1} for ItemList scraper failed.")
-        time.sleep(5)
+def create_tkinter_gui(prefetch=None, run_options=None, store_rates=True):
+    # Tk is only imported for the interactive session, so headless runs work without a display
+    import tkinter as tk
+    from tkinter import ttk, messagebox
 
-    if codate_df is not None and itemlist_df is not None:
-        print("Data processing completed successfully. Variables stored in codate_df and itemlist_df.")
-        file_analysis(codate_df, itemlist_df, df_cell_run)
-    else:
-        print("Data processing failed. Check the logs for more information.")
-        
-def create_tkinter_gui():
+    run_options = run_options or {}
     root = tk.Tk()
     root.attributes('-fullscreen', True)  # Set fullscreen mode
     root.title("Run Rate Adjustments")
@@ -410,16 +1741,25 @@ def create_tkinter_gui():
 
     ttk.Label(scrollable_frame, text="Adjust Run Rates for Each Cell", font=("Helvetica", 16)).grid(row=0, column=0, columnspan=2, pady=10)
 
-    row = 1
+    # The cell entries get their own frame, so cells added from a paste never land on the widgets below
+    entries_frame = ttk.Frame(scrollable_frame)
+    entries_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E))
     entries = {}
-    for cell, rate in cell_run_rates.items():
-        ttk.Label(scrollable_frame, text=f"Cell {cell}:", font=("Helvetica", 12)).grid(row=row, column=0, sticky=tk.E, padx=10, pady=5)
-        entry = ttk.Entry(scrollable_frame, font=("Helvetica", 12))
+
+    def add_entry(cell, rate):
+        entry_row = len(entries)
+        ttk.Label(entries_frame, text=f"Cell {cell}:", font=("Helvetica", 12)).grid(row=entry_row, column=0, sticky=tk.E, padx=10, pady=5)
+        entry = ttk.Entry(entries_frame, font=("Helvetica", 12))
         entry.insert(0, rate)
-        entry.grid(row=row, column=1, sticky=(tk.W, tk.E), padx=10, pady=5)
+        entry.grid(row=entry_row, column=1, sticky=(tk.W, tk.E), padx=10, pady=5)
         entries[cell] = entry
-        row += 1
 
+    # Save stores only what is edited here, so rates from a --run-rates file stay out of the store
+    shown_rates = dict(cell_run_rates)
+    for cell, rate in cell_run_rates.items():
+        add_entry(cell, rate)
+
+    row = 2
     ttk.Label(scrollable_frame, text="Paste Excel Data:", font=("Helvetica", 12)).grid(row=row, column=0, pady=10, sticky=tk.W)
     row += 1
     text_widget = tk.Text(scrollable_frame, height=10, width=80, font=("Helvetica", 12))
@@ -427,33 +1767,9 @@ def create_tkinter_gui():
 
     def update_run_rates_from_paste():
         try:
-            # Get the pasted text from the Text widget
+            # Get the pasted text from the Text widget and add or update each cell run rate
             pasted_data = text_widget.get("1.0", tk.END).strip()
-
-            # Process the pasted text to ensure correct format
-            lines = pasted_data.splitlines()
-            processed_data = []
-            for line in lines:
-                parts = line.split()
-                if len(parts) >= 2:
-                    cell = parts[0]
-                    rate = parts[-1].replace(",", "")
-                    processed_data.append(f"{cell}\t{rate}")
-
-            processed_data = "\n".join(processed_data)
-
-            # Convert the pasted text to a pandas DataFrame
-            data = StringIO(processed_data)
-            df_pasted = pd.read_csv(data, sep="\t", header=None, names=["Cell", "Run Rate"])
-
-            # Convert Run Rate to float
-            df_pasted["Run Rate"] = df_pasted["Run Rate"].astype(float)
-
-            # Update the cell_run_rates dictionary and DataFrame
-            for index, row in df_pasted.iterrows():
-                cell = str(row["Cell"])
-                rate = row["Run Rate"]
-                cell_run_rates[cell] = rate  # Add or update the cell run rate
+            cell_run_rates.update(parse_run_rates_text(pasted_data))
 
             # Update the GUI entries
             for cell, entry in entries.items():
@@ -461,12 +1777,7 @@ def create_tkinter_gui():
                 entry.insert(0, cell_run_rates[cell])
             for cell, rate in cell_run_rates.items():
                 if cell not in entries:
-                    ttk.Label(scrollable_frame, text=f"Cell {cell}:", font=("Helvetica", 12)).grid(row=row, column=0, sticky=tk.E, padx=10, pady=5)
-                    entry = ttk.Entry(scrollable_frame, font=("Helvetica", 12))
-                    entry.insert(0, rate)
-                    entry.grid(row=row, column=1, sticky=(tk.W, tk.E), padx=10, pady=5)
-                    entries[cell] = entry
-                    row += 1
+                    add_entry(cell, rate)
             
             messagebox.showinfo("Success", "Run rates updated from pasted data!")
         except Exception as e:
@@ -475,18 +1786,221 @@ def create_tkinter_gui():
     row += 1
     ttk.Button(scrollable_frame, text="Update from Paste", command=update_run_rates_from_paste, style="TButton").grid(row=row, column=0, columnspan=2, pady=10)
 
+    # The pipeline runs on a worker thread; its log lines, stage progress and final status come back
+    # through this queue, which the Tk event loop drains, since only the main thread may touch widgets
+    events = queue.Queue()
+    log_handler = QueueLogHandler(events)
+    log_handler.setLevel(logging.INFO)
+    log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', '%H:%M:%S'))
+
+    def on_stage(record, finished):
+        events.put(("stage", id(record), dict(record), finished))
+
+    worker = None
+    pending_prefetch = prefetch
+    fetched = {}
+    running_stages = {}
+    panel = {}
+
+    def show_run_panel():
+        if panel:
+            return
+        run_frame = ttk.Frame(main_frame, padding="10")
+        run_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E))
+        run_frame.grid_columnconfigure(0, weight=1)
+        panel["status"] = ttk.Label(run_frame, font=("Helvetica", 12))
+        panel["status"].grid(row=0, column=0, columnspan=2, sticky=tk.W)
+        panel["progress"] = ttk.Progressbar(run_frame, mode="indeterminate")
+        panel["progress"].grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+        panel["log"] = tk.Text(run_frame, height=12, font=("Courier", 10), state="disabled")
+        panel["log"].grid(row=2, column=0, sticky=(tk.W, tk.E))
+        log_scrollbar = ttk.Scrollbar(run_frame, orient="vertical", command=panel["log"].yview)
+        log_scrollbar.grid(row=2, column=1, sticky=(tk.N, tk.S))
+        panel["log"].configure(yscrollcommand=log_scrollbar.set)
+
+        buttons = ttk.Frame(run_frame)
+        buttons.grid(row=3, column=0, columnspan=2, pady=5)
+        panel["cancel"] = ttk.Button(buttons, text="Cancel", command=cancel, style="TButton")
+        panel["cancel"].grid(row=0, column=0, padx=5)
+        panel["rerun"] = ttk.Button(buttons, text="Re-run", command=save_run_rates, style="TButton")
+        panel["rerun"].grid(row=0, column=1, padx=5)
+        ttk.Button(buttons, text="Close", command=root.destroy, style="TButton").grid(row=0, column=2, padx=5)
+
+    def append_log(line):
+        log = panel["log"]
+        log.configure(state="normal")
+        log.insert(tk.END, line + "\n")
+        # Keep the last thousand lines; the full log is in app.log
+        if int(log.index("end-1c").split(".")[0]) > 1000:
+            log.delete("1.0", "2.0")
+        log.see(tk.END)
+        log.configure(state="disabled")
+
+    def describe_stage(record):
+        detail = record.get("report") or record.get("sheet")
+        return f"{record['stage']} ({detail})" if detail else record["stage"]
+
+    def run_finished(status, results):
+        nonlocal worker
+        worker = None
+        fetched.update({name: result for name, result in results.items() if result.df is not None})
+        running_stages.clear()
+        panel["progress"].stop()
+        messages = {
+            "ok": f"Finished. The workbook is in {os.path.abspath(run_options.get('output_dir', '.'))}",
+            "fetched": "Finished fetching the reports",
+            "fetch_failed": "A report could not be fetched. Re-run to try again.",
+            "cancelled": "Cancelled. Re-run to start again with the reports fetched so far.",
+            "error": "The run failed. Check the log for details.",
+        }
+        panel["status"].configure(text=messages[status])
+        panel["cancel"].state(["disabled"])
+        panel["rerun"].state(["!disabled"])
+        save_button.state(["!disabled"])
+
+    def poll_events():
+        while True:
+            try:
+                event = events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == "log":
+                append_log(event[1])
+            elif event[0] == "stage":
+                _, key, record, finished = event
+                if finished:
+                    running_stages.pop(key, None)
+                    append_log(f"  {describe_stage(record)}: {record.get('status')} in {record['seconds']:.2f}s")
+                else:
+                    running_stages[key] = (describe_stage(record), time.time())
+            elif event[0] == "done":
+                run_finished(event[1], event[2])
+        if worker is not None and running_stages:
+            current, started = list(running_stages.values())[-1]
+            panel["status"].configure(text=f"Running {current} ({time.time() - started:.0f}s)")
+        root.after(100, poll_events)
+
+    def run_worker(run_prefetch, previous):
+        status, results = "error", {}
+        try:
+            status, results = run_pipeline(prefetch=run_prefetch, fetched=previous, **run_options)
+        finally:
+            events.put(("done", status, results))
+
     def save_run_rates():
-        global cell_run_rates
-        for cell, entry in entries.items():
-            cell_run_rates[cell] = float(entry.get())
+        nonlocal worker, pending_prefetch
+        try:
+            rates = {cell: float(entry.get()) for cell, entry in entries.items()}
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid run rate: {e}")
+            return
+        set_run_rates(rates)
+        # A session opened with --as-of shows historical rates; storing them would rewrite today's
+        if store_rates:
+            save_run_rates_to_store({cell: rate for cell, rate in rates.items() if shown_rates.get(cell) != rate})
+        else:
+            logger.info("Run rates loaded with --as-of are used for this run only and not stored")
         logger.info("Run rates updated.")
-        root.destroy()
+
+        show_run_panel()
+        save_button.state(["disabled"])
+        panel["rerun"].state(["disabled"])
+        panel["cancel"].state(["!disabled"])
+        panel["status"].configure(text="Starting...")
+        panel["progress"].start(10)
+        # The first run picks up the background prefetch, later runs reuse what has been fetched
+        run_prefetch, pending_prefetch = pending_prefetch, None
+        worker = threading.Thread(target=run_worker, args=(run_prefetch, dict(fetched)), name="pipeline")
+        worker.start()
+
+    def cancel():
+        panel["cancel"].state(["disabled"])
+        panel["status"].configure(text="Cancelling...")
+        # Quitting the browsers can take a few seconds, so keep it off the event loop
+        threading.Thread(target=cancel_run, name="cancel", daemon=True).start()
 
     row += 1
-    ttk.Button(scrollable_frame, text="Save", command=save_run_rates, style="TButton").grid(row=row, column=0, columnspan=2, pady=10)
+    save_button = ttk.Button(scrollable_frame, text="Save", command=save_run_rates, style="TButton")
+    save_button.grid(row=row, column=0, columnspan=2, pady=10)
 
-    root.mainloop()
+    logger.addHandler(log_handler)
+    stage_listeners.append(on_stage)
+    try:
+        poll_events()
+        root.mainloop()
+    finally:
+        logger.removeHandler(log_handler)
+        stage_listeners.remove(on_stage)
+        # Closing the window stops whatever is still downloading or running
+        if worker is not None or (pending_prefetch is not None and not pending_prefetch.future.done()):
+            cancel_run()
+
+# Exit codes for headless runs, so a scheduler can tell a dead report server from a bad run-rate file
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_FETCH_FAILED = 3
+PIPELINE_EXIT_CODES = {"ok": EXIT_OK, "fetched": EXIT_OK, "fetch_failed": EXIT_FETCH_FAILED, "error": EXIT_ERROR,
+                       "cancelled": EXIT_ERROR}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run Rates Tool")
+    parser.add_argument("--headless", action="store_true", help="run the pipeline without the GUI and exit with a status code")
+    parser.add_argument("--run-rates", help="CSV (cell,rate) or pasted-sheet text file of run rates to use for this run instead of the stored ones")
+    parser.add_argument("--as-of", type=date.fromisoformat, help="use the stored run rates in force on this date (YYYY-MM-DD) instead of today's; the GUI then does not store edits")
+    parser.add_argument("--reports", nargs="+", choices=sorted(REPORTS), default=["codate", "itemlist"],
+                        help="reports to fetch; the analysis runs when both are fetched")
+    parser.add_argument("--refresh", action="store_true", help="ignore cached reports and fetch them again")
+    parser.add_argument("--cache-ttl", type=float, help="seconds a cached report stays fresh (default 900)")
+    parser.add_argument("--incremental", action="store_true", help="add a sheet of the order lines that changed since the last run")
+    parser.add_argument("--output-dir", default=".", help="folder for the workbook and any parquet/csv outputs")
+    parser.add_argument("--sheets", choices=sorted(SHEET_SETS), default="full", help="write every sheet or only the summary sheets")
+    parser.add_argument("--format", dest="formats", action="append", choices=OUTPUT_FORMATS,
+                        help="output format, may be repeated (default xlsx)")
+    parser.add_argument("--scenarios", help="CSV of scenario,cell,rate; adds a sheet comparing the what-if run rates with the current ones")
+    parser.add_argument("--profile", choices=("cprofile", "pyinstrument"), help="profile the whole run and save the result")
+    return parser.parse_args(argv)
+
+def load_input_files(args):
+    # The run-rate and scenario files named on the command line; a bad file is a usage error in both modes
+    load_stored_run_rates(args.as_of)
+    if args.run_rates:
+        try:
+            set_run_rates(load_run_rates_file(args.run_rates))
+        except Exception as e:
+            logger.error(f"Could not read run rates from {args.run_rates}: {e}")
+            return False, None
+    scenarios = None
+    if args.scenarios:
+        try:
+            scenarios = load_scenarios_file(args.scenarios)
+        except Exception as e:
+            logger.error(f"Could not read scenarios from {args.scenarios}: {e}")
+            return False, None
+    return True, scenarios
+
+def run_headless(args):
+    loaded, scenarios = load_input_files(args)
+    if not loaded:
+        return EXIT_USAGE
+    status, _ = run_pipeline(reports=args.reports, refresh=args.refresh, incremental=args.incremental,
+                             output_dir=args.output_dir, sheet_set=args.sheets, formats=args.formats or ('xlsx',),
+                             profiler=args.profile, open_workbook=False, scenarios=scenarios)
+    return PIPELINE_EXIT_CODES[status]
 
 if __name__ == "__main__":
-    create_tkinter_gui()
-    load_data()
+    configure_logging()
+    args = parse_args()
+    if args.cache_ttl is not None:
+        get_report_cache().ttl = args.cache_ttl
+    if args.headless:
+        sys.exit(run_headless(args))
+    loaded, scenarios = load_input_files(args)
+    if not loaded:
+        sys.exit(EXIT_USAGE)
+    # The reports do not depend on the run rates, so they download while the user edits them
+    prefetch = start_prefetch(args.reports, refresh=args.refresh)
+    create_tkinter_gui(prefetch, dict(reports=args.reports, refresh=args.refresh, incremental=args.incremental,
+                                      output_dir=args.output_dir, sheet_set=args.sheets, formats=args.formats or ('xlsx',),
+                                      profiler=args.profile, scenarios=scenarios),
+                       store_rates=args.as_of is None)